@@ -0,0 +1,28 @@
+# Helpers shared by the benchmarks, which put src on sys.path before importing this module
+import multiprocessing
+import resource
+import time
+
+from build_center_client.cli.commands.stub_server import StubServer
+from build_center_client.cli.commands.test import percentile  # noqa: F401
+
+
+def _run_stub_server(urls, latency: float):
+    server = StubServer(latency=latency).start()
+    urls.put(server.url)
+    while True:
+        time.sleep(3600)
+
+
+def start_stub_server(latency: float = 0):
+    # In a child process, so that only the client's CPU time is counted. Returns the process,
+    # which the caller terminates, and the URL of the server.
+    urls = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_stub_server, args=(urls, latency), daemon=True)
+    process.start()
+    return process, urls.get(timeout=10)
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
@@ -0,0 +1,57 @@
+# Measures CLI startup with python -X importtime: the cumulative import time, the number of
+# imported modules and the wall time of a few commands that don't need a server.
+#
+#   python benchmarks/cli_import_time.py [--runs 10] [--top 5]
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+commands = (
+    ["--help"],
+    ["apps", "--help"],
+    ["assets", "create", "--help"],
+    ["batch", "--help"],
+)
+# "import time: self [us] | cumulative | imported package", nested imports are indented
+line_pattern = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def run(args):
+    env = dict(os.environ, PYTHONPATH=src_path)
+    started_at = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-m", "build_center_client.cli.main"] + args,
+                             env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+    elapsed = time.perf_counter() - started_at
+    imports = []
+    for line in process.stderr.splitlines():
+        match = line_pattern.match(line)
+        if match is not None:
+            imports.append((int(match.group(2)), len(match.group(3)), match.group(4)))
+    return elapsed, imports
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=5, help="slowest top-level imports to list")
+    args = parser.parse_args()
+    for command in commands:
+        results = [run(command) for _ in range(args.runs)]
+        elapsed = statistics.median(result[0] for result in results)
+        # Top-level imports have a single space of indentation
+        top_level = [(cumulative, name) for cumulative, indent, name in results[-1][1] if indent == 1]
+        import_time = sum(cumulative for cumulative, _ in top_level)
+        print(f"{' '.join(command):<24}{elapsed * 1000:>8.1f} ms wall{import_time / 1000:>8.1f} ms imports"
+              f"{len(results[-1][1]):>6} modules")
+        for cumulative, name in sorted(top_level, reverse=True)[:args.top]:
+            print(f"    {cumulative / 1000:>8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Compares the requests (HTTP/1.1) and httpx (HTTP/2) transports for many concurrent small
+# GET requests: throughput, latency percentiles and client CPU time. By default both run against
+# a local stub server, which speaks HTTP/2 without TLS (h2c), and adds --latency-ms to every
+# response so that waiting requests overlap as they would with a remote server. Pass --server,
+# --token and --app for a real server.
+#
+#   python benchmarks/http2_comparison.py [--threads 32] [--calls 50] [--latency-ms 20]
+#                                         [--server URL --token TOKEN --app APP]
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from build_center_client.api.api import Api  # noqa: E402
+from build_center_client.api.http import ApiHttpClient  # noqa: E402
+from build_center_client.api.transport import Http2Transport  # noqa: E402
+from _common import cpu_seconds, percentile, start_stub_server  # noqa: E402
+
+
+def negotiated_version(url: str, token: str) -> str:
+    transport = Http2Transport()
+    headers = {} if token is None else {"Authorization": f"Bearer {token}"}
+    response = transport.request("GET", url.rstrip("/") + "/admin/apps", headers)
+    try:
+        return response._response.http_version
+    finally:
+        response.close()
+        transport.close()
+
+
+def run(label: str, url: str, token: str, http2: bool, threads: int, calls: int, app_id: str):
+    # Coalescing is disabled so that every call is a request of its own
+    api = Api(ApiHttpClient(url, token=token, http2=http2, pool_size=threads, coalesce_requests=False))
+    api.apps.get(app_id)
+    latencies = []
+    errors = []
+
+    def work(_):
+        for _ in range(calls):
+            started_at = time.perf_counter()
+            try:
+                api.apps.get(app_id)
+            except Exception as e:
+                # Counted rather than raised, so that a transport that fails now and then can be told apart
+                errors.append(e)
+                continue
+            latencies.append(time.perf_counter() - started_at)
+
+    started_cpu, started_at = cpu_seconds(), time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(work, range(threads)))
+    elapsed, cpu = time.perf_counter() - started_at, cpu_seconds() - started_cpu
+    latencies.sort()
+    print(f"{label:<10}{len(latencies) / elapsed:>8.0f} req/s{percentile(latencies, 50) * 1000:>8.1f} ms p50"
+          f"{percentile(latencies, 99) * 1000:>8.1f} ms p99{cpu * 1000 / len(latencies):>8.2f} ms CPU/req"
+          f"{len(errors):>6} errors")
+    for error in errors[:3]:
+        print(f"    {type(error).__name__}: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--calls", type=int, default=50, help="calls per thread")
+    parser.add_argument("--latency-ms", type=float, default=20, help="latency of the stub server's responses")
+    parser.add_argument("--server", help="Build Center URL, by default a local stub server")
+    parser.add_argument("--token")
+    parser.add_argument("--app", help="app to get from --server")
+    args = parser.parse_args()
+
+    stub = None
+    url, app_id = args.server, args.app
+    if url is None:
+        stub, url = start_stub_server(args.latency_ms / 1000)
+        app_id = Api(ApiHttpClient(url)).apps.create(name="benchmark", title="Benchmark").id
+    elif app_id is None:
+        parser.error("--app is required with --server")
+    try:
+        print(f"httpx negotiates {negotiated_version(url, args.token)} with {url}")
+        run("requests", url, args.token, False, args.threads, args.calls, app_id)
+        run("httpx", url, args.token, True, args.threads, args.calls, app_id)
+    finally:
+        if stub is not None:
+            stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Compares json_backend with the json module for API-sized payloads: parsing a list of assets,
+# pretty-printing it as the CLI does and encoding it compactly as request bodies are.
+#
+#   python benchmarks/json_speed.py [--items 1000] [--runs 20]
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from build_center_client.api import json_backend  # noqa: E402
+
+
+def payload(items: int) -> list:
+    return [dict(id=str(uuid.uuid4()), name=f"asset-{i}.zip", url=f"https://example.com/admin/assets/{i}",
+                 contentSize=i * 1024, contentHashAlgorithm="sha256", contentHash=uuid.uuid4().hex * 2,
+                 createdAt=1700000000000 + i, releaseId=str(uuid.uuid4()), score=i / 7,
+                 tags={"platform": "linux", "arch": "x86_64", "debug": None})
+            for i in range(items)]
+
+
+def measure(runs: int, func) -> float:
+    best = None
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started_at
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    data = payload(args.items)
+    raw = json.dumps(data).encode("utf-8")
+    print(f"{args.items} assets, {len(raw) / 1024:.0f} KiB, orjson "
+          f"{'not installed' if json_backend.orjson is None else json_backend.orjson.__version__}")
+    cases = (
+        ("loads", lambda: json.loads(raw), lambda: json_backend.loads(raw)),
+        ("dumps indent=2", lambda: json.dumps(data, indent=2), lambda: json_backend.dumps(data, indent=2)),
+        ("dumps compact", lambda: json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8"),
+         lambda: json_backend.dumps_compact(data)),
+    )
+    for label, json_func, backend_func in cases:
+        json_time, backend_time = measure(args.runs, json_func), measure(args.runs, backend_func)
+        print(f"{label:<16}{json_time * 1000:>8.2f} ms json{backend_time * 1000:>8.2f} ms json_backend"
+              f"{json_time / backend_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
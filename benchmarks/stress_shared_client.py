@@ -0,0 +1,118 @@
+# Stress test of one API client shared by many threads, and inherited by forked processes
+# while those threads are busy, against the in-process stub server. Exits with 1 on errors.
+#
+#   python benchmarks/stress_shared_client.py [--threads 32] [--calls 100] [--forks 8]
+import argparse
+import io
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from build_center_client.api.api import Api  # noqa: E402
+from build_center_client.api.http import ApiHttpClient  # noqa: E402
+from build_center_client.api.timeouts import deadline  # noqa: E402
+from build_center_client.cli.commands.stub_server import StubServer  # noqa: E402
+
+
+def call(api: Api, app_id: str, asset_id: str, index: int):
+    # A mix of coalesced list requests, plain gets, creates and throttled downloads
+    kind = index % 4
+    if kind == 0:
+        api.apps.list()
+    elif kind == 1:
+        api.apps.get(app_id)
+    elif kind == 2:
+        api.apps.get(app_id).releases().create(version=f"0.0.{index}")
+    else:
+        out = io.BytesIO()
+        api.assets.get(asset_id).download(out)
+        if len(out.getvalue()) != 64 * 1024:
+            raise Exception("Incomplete download")
+
+
+def run_calls(api: Api, app_id: str, asset_id: str, threads: int, calls: int):
+    errors = []
+
+    def work(thread: int):
+        for i in range(calls):
+            try:
+                call(api, app_id, asset_id, thread * calls + i)
+            except Exception as e:
+                errors.append(e)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(work, range(threads)))
+    return errors
+
+
+def run_child(api: Api, app_id: str, asset_id: str, calls: int):
+    # The inherited client must work on its own connections, with locks that weren't
+    # left held by the parent's threads
+    try:
+        with deadline(30):
+            for i in range(calls):
+                call(api, app_id, asset_id, i)
+    except Exception as e:
+        print(f"child {os.getpid()}: {type(e).__name__}: {e}", file=sys.stderr)
+        os._exit(1)
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--calls", type=int, default=100, help="calls per thread and per forked process")
+    parser.add_argument("--forks", type=int, default=8)
+    parser.add_argument("--http2", action="store_true", help="use the httpx transport")
+    args = parser.parse_args()
+
+    with StubServer() as server:
+        api = Api(ApiHttpClient(server.url, http2=args.http2, pool_size=args.threads, connect_timeout=5,
+                                read_timeout=30, download_rate_limit=1024 ** 3))
+        app = api.apps.create(name="stress", title="Stress")
+        release = app.releases().create(version="1.0.0")
+        asset = release.assets().create_with_file("asset.bin", io.BytesIO(os.urandom(64 * 1024)))
+
+        started_at = time.perf_counter()
+        errors = run_calls(api, app.id, asset.id, args.threads, args.calls)
+        elapsed = time.perf_counter() - started_at
+        total = args.threads * args.calls
+        print(f"shared client: {total} calls from {args.threads} threads in {elapsed:.2f} s, "
+              f"{total / elapsed:.0f} calls/s, {len(errors)} errors")
+        for error in errors[:5]:
+            print(f"    {type(error).__name__}: {error}")
+
+        # Fork while the parent's threads are in the middle of requests
+        context = multiprocessing.get_context("fork")
+        background_errors = []
+        background = threading.Thread(target=lambda: background_errors.extend(
+            run_calls(api, app.id, asset.id, 8, args.calls)))
+        background.start()
+        children = []
+        for _ in range(args.forks):
+            time.sleep(0.01)
+            child = context.Process(target=run_child, args=(api, app.id, asset.id, args.calls))
+            child.start()
+            children.append(child)
+        for child in children:
+            child.join(60)
+            if child.exitcode is None:
+                # Hung, e.g. on a lock inherited in the locked state
+                child.terminate()
+                child.join()
+        background.join()
+        failed_children = [child for child in children if child.exitcode != 0]
+        print(f"forked: {args.forks} processes with {args.calls} calls each, {len(failed_children)} failed, "
+              f"{len(background_errors)} errors in the parent meanwhile")
+
+    if errors or failed_children or background_errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Measures the client CPU time per GB of asset upload and download against a local stub
+# server. The server runs in a child process, so that only the client's CPU time is counted.
+# Downloads are also made the way the client used to, reading r.content and then going through
+# iter_content() of requests, and with iter_content() alone, to show the CPU time saved.
+#
+#   python benchmarks/transfer_cpu.py --size-mb 200 [--http2]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from build_center_client.api.api import Api  # noqa: E402
+from build_center_client.api.http import ApiHttpClient  # noqa: E402
+from _common import cpu_seconds, start_stub_server  # noqa: E402
+
+
+def measure(label: str, size: int, func) -> float:
+    started_cpu, started_at = cpu_seconds(), time.perf_counter()
+    func()
+    cpu, elapsed = cpu_seconds() - started_cpu, time.perf_counter() - started_at
+    gb = size / 1024 ** 3
+    print(f"{label:<20}{cpu:>8.2f} s CPU{cpu / gb:>8.2f} s CPU/GB{elapsed:>8.2f} s wall"
+          f"{size / elapsed / 1024 ** 2:>9.1f} MiB/s")
+    return cpu / gb
+
+
+def download_iter_content(url: str, out, read_content: bool):
+    # The download loop before it read into a reused buffer. It also logged r.content, which
+    # read the whole body into memory first.
+    import requests
+    with requests.get(url, stream=True) as r:
+        if read_content:
+            r.content
+        for chunk in r.iter_content(chunk_size=1024 * 1024):
+            if chunk:
+                out.write(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=200)
+    parser.add_argument("--http2", action="store_true", help="use the httpx transport")
+    args = parser.parse_args()
+    size = args.size_mb * 1024 * 1024
+
+    server, url = start_stub_server()
+    try:
+        api = Api(ApiHttpClient(url, http2=args.http2))
+        release = api.apps.create(name="benchmark", title="Benchmark").releases().create(version="1.0.0")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            upload_path = os.path.join(temp_dir, "upload.bin")
+            with open(upload_path, "wb") as f:
+                chunk = os.urandom(1024 * 1024)
+                for _ in range(args.size_mb):
+                    f.write(chunk)
+            assets = []
+            with open(upload_path, "rb") as f:
+                measure("upload", size, lambda: assets.append(release.assets().create_with_file("upload.bin", f)))
+            with open(os.path.join(temp_dir, "download.bin"), "wb") as f:
+                cpu_per_gb = measure("download", size, lambda: assets[0].download(f))
+            download_url = f"{url}/admin/assets/{assets[0].id}/download"
+            for label, read_content in (("download (old)", True), ("iter_content only", False)):
+                with open(os.path.join(temp_dir, "download.bin"), "wb") as f:
+                    old_cpu_per_gb = measure(label, size, lambda: download_iter_content(download_url, f, read_content))
+                print(f"    saved {old_cpu_per_gb - cpu_per_gb:.2f} s CPU/GB "
+                      f"({(old_cpu_per_gb - cpu_per_gb) / old_cpu_per_gb * 100:.0f}%)")
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
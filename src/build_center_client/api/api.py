@@ -1,6 +1,9 @@
-from typing import Dict, IO, List, Optional, TypeVar, Union
+from typing import Any, Callable, Dict, IO, List, Optional, TypeVar, Union
 from dataclasses import dataclass
+import hashlib
+import os
 import posixpath
+import threading
 from enum import Enum, IntFlag
 
 from .base_endpoints import \
@@ -11,10 +14,39 @@ from .base_endpoints import \
     ListResourceEndpoint, \
     UpdateResourceEndpoint
 from .http import ApiHttpClient
+from .archives import archive_format, extract_download, upload_directory
+from .indexes import AssetTagIndex, ReleaseVersionIndex
+from .progress import Progress, ProgressTracker, chain_callbacks
+from .streams import remaining_file_size
+from . import timeouts
 
 
 TEndpoint = TypeVar("TEndpoint")
 
+# Guards the lazy creation of nested endpoints, so that concurrent callers get the same one.
+# Creating an endpoint doesn't send requests, so a single lock doesn't slow anything down.
+_endpoint_lock = threading.Lock()
+
+
+def _reset_endpoint_lock_after_fork():
+    global _endpoint_lock
+    _endpoint_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_endpoint_lock_after_fork)
+
+
+def _get_endpoint(resource: Any, attribute: str, factory: Callable[[], TEndpoint]) -> TEndpoint:
+    endpoint = getattr(resource, attribute)
+    if endpoint is None:
+        with _endpoint_lock:
+            endpoint = getattr(resource, attribute)
+            if endpoint is None:
+                endpoint = factory()
+                setattr(resource, attribute, endpoint)
+    return endpoint
+
 
 class HashAlgorithm(Enum):
     SHA256 = "sha256"
@@ -27,6 +59,36 @@ class AccessFlags(IntFlag):
     WRITE = 4
 
 
+class AssetIntegrityError(Exception):
+    pass
+
+
+class UploadDigest:
+    # Hashes file content while it is being uploaded
+    def __init__(self, algorithm: HashAlgorithm) -> None:
+        self.algorithm = algorithm
+        self.size = 0
+        self._hash = hashlib.new(algorithm.value)
+
+    def update(self, data: memoryview):
+        self._hash.update(data)
+        self.size += len(data)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+    def verify(self, asset: "Asset"):
+        if asset.content_hash_algorithm != self.algorithm:
+            raise AssetIntegrityError(
+                f"Asset {asset.id} was hashed with {asset.content_hash_algorithm} instead of {self.algorithm}")
+        if asset.content_size != self.size:
+            raise AssetIntegrityError(
+                f"Asset {asset.id} has size {asset.content_size} but {self.size} bytes were uploaded")
+        if asset.content_hash is None or asset.content_hash.lower() != self.hexdigest():
+            raise AssetIntegrityError(
+                f"Asset {asset.id} has hash {asset.content_hash} but uploaded content has hash {self.hexdigest()}")
+
+
 @dataclass
 class Asset:
     name: str
@@ -41,13 +103,32 @@ class Asset:
 
     _client: ApiHttpClient = None
     _raw: str = None
+    _local_content_hash: str = None
 
     def raw(self) -> str:
         return self._raw
 
-    def download(self, io: IO):
+    def local_content_hash(self) -> Optional[str]:
+        # Hash of the uploaded content as computed locally, if the upload was verified
+        return self._local_content_hash
+
+    def download(self, io: IO, on_progress: Callable[[Progress], None] = None):
         download_url = posixpath.join(self.url, "download")
-        return self._client.get(download_url, "application/octet-stream", out_stream=io)
+        tracker = None if on_progress is None else ProgressTracker(on_progress, self.content_size)
+        self._client.get(download_url, "application/octet-stream", out_stream=io,
+                         out_stream_size=self.content_size,
+                         on_download_data=None if tracker is None else tracker.update)
+        if tracker is not None:
+            tracker.finish()
+
+    def extract_to(self, path: str, format: str = None, on_progress: Callable[[Progress], None] = None):
+        # Unpacks an archive asset into a directory while it is being downloaded. The format
+        # is a suffix such as ".tar.gz", ".tar.zst" or ".zip", by default taken from the name.
+        format = archive_format(self.name) if format is None else format
+        if format is None:
+            raise Exception(f"Asset {self.id} is not a supported archive: {self.name}")
+        extract_download(lambda io: self.download(io, on_progress=on_progress), format, path,
+                         size=self.content_size)
 
 
 class AssetEndpoint(CreateResourceWithFileEndpoint[Asset],
@@ -55,10 +136,48 @@ class AssetEndpoint(CreateResourceWithFileEndpoint[Asset],
                     GetResourceEndpoint[Asset],
                     DeleteResourceEndpoint):
 
-    def create_with_file(self, name: str, file: IO, tags: Dict[str, str] = None):
+    def create_with_file(self, name: str, file: IO, tags: Dict[str, str] = None, verify: bool = False,
+                         hash_algorithm: HashAlgorithm = HashAlgorithm.SHA256,
+                         on_progress: Callable[[Progress], None] = None):
         tags = None if tags is None else [tag[0] if len(tag) == 1 or tag[1] is None else (
             "%s=%s" % (tag[0], tag[1])) for tag in tags.items()]
-        return super().create_with_file(name, file, tag=tags)
+        # The content is hashed as it is sent, so the file doesn't need to be read again
+        digest = UploadDigest(hash_algorithm) if verify else None
+        tracker = None if on_progress is None else ProgressTracker(on_progress, remaining_file_size(file))
+        asset = super().create_with_file(name, file, tag=tags, on_upload_data=chain_callbacks(
+            None if digest is None else digest.update, None if tracker is None else tracker.update))
+        if tracker is not None:
+            tracker.finish()
+        if digest is not None:
+            digest.verify(asset)
+            asset._local_content_hash = digest.hexdigest()
+        self._get_tag_index().add(self._list_url, asset)
+        return asset
+
+    def create_from_directory(self, name: str, path: str, format: str = None, tags: Dict[str, str] = None,
+                              verify: bool = False, hash_algorithm: HashAlgorithm = HashAlgorithm.SHA256,
+                              on_progress: Callable[[Progress], None] = None):
+        # Uploads a directory as an archive that is built while it is being sent. The format
+        # is a suffix such as ".tar.gz", ".tar.zst" or ".zip", by default taken from the name.
+        format = archive_format(name) if format is None else format
+        if format is None:
+            raise Exception(f"Can't tell the archive format from the asset name: {name}")
+        return upload_directory(path, format, lambda file: self.create_with_file(
+            name, file, tags=tags, verify=verify, hash_algorithm=hash_algorithm, on_progress=on_progress))
+
+    def find(self, tags: Dict[str, Optional[str]], refresh: bool = False) -> List[Asset]:
+        # The assets are listed once per session and then looked up through the tag index
+        index = self._get_tag_index()
+        if refresh or not index.has_scope(self._list_url):
+            index.refresh(self._list_url, self.list())
+        return index.find(tags, self._list_url)
+
+    def delete(self, id: str):
+        super().delete(id)
+        self._get_tag_index().remove(id)
+
+    def _get_tag_index(self) -> AssetTagIndex:
+        return self._list_client.session_object(AssetTagIndex, AssetTagIndex)
 
     def __init__(self, url: str, client: ApiHttpClient) -> None:
         CreateResourceWithFileEndpoint.__init__(
@@ -93,10 +212,8 @@ class Release:
 
     def assets(self) -> Union[CreateResourceWithFileEndpoint[Asset],
                               ListResourceEndpoint[Asset]]:
-        if self._assets is None:
-            self._assets = AssetEndpoint(
-                posixpath.join(self.url, "assets"), self._client)
-        return self._assets
+        return _get_endpoint(self, "_assets", lambda: AssetEndpoint(
+            posixpath.join(self.url, "assets"), self._client))
 
 
 class ReleaseEndpoint(CreateResourceEndpoint[Release, Release],
@@ -115,6 +232,38 @@ class ReleaseEndpoint(CreateResourceEndpoint[Release, Release],
             self, url, client, request_type=Release, response_type=Release)
         DeleteResourceEndpoint.__init__(self, url, client)
 
+    def create(self, *args, **kwargs) -> Release:
+        release = super().create(*args, **kwargs)
+        if isinstance(release, Release):
+            self._get_version_index().put(release, self._list_url)
+        return release
+
+    def update(self, *args, **kwargs) -> Release:
+        release = super().update(*args, **kwargs)
+        if isinstance(release, Release):
+            self._get_version_index().put(release)
+        return release
+
+    def delete(self, id: str):
+        super().delete(id)
+        self._get_version_index().remove(id)
+
+    def latest(self, prerelease: bool = False, published: Optional[bool] = True,
+               refresh: bool = False) -> Optional[Release]:
+        return self.resolve(None, prerelease=prerelease, published=published, refresh=refresh)
+
+    def resolve(self, constraint: str = None, prerelease: bool = False, published: Optional[bool] = True,
+                refresh: bool = False) -> Optional[Release]:
+        # Returns the release with the highest semantic version that matches the constraint,
+        # e.g. ">=1.2,<2". The releases are listed once per session and kept in a version index.
+        index = self._get_version_index()
+        if refresh or not index.has_scope(self._list_url):
+            index.refresh(self._list_url, self.list())
+        return index.resolve(self._list_url, constraint, prerelease=prerelease, published=published)
+
+    def _get_version_index(self) -> ReleaseVersionIndex:
+        return self._list_client.session_object(ReleaseVersionIndex, ReleaseVersionIndex)
+
 
 class WebhookType(Enum):
     DISCORD = "discord"
@@ -221,24 +370,18 @@ class App:
 
     def releases(self) -> Union[CreateResourceEndpoint[Release, Release],
                                 ListResourceEndpoint[Release]]:
-        if self._releases is None:
-            self._releases = ReleaseEndpoint(
-                posixpath.join(self.url, "releases"), self._client)
-        return self._releases
+        return _get_endpoint(self, "_releases", lambda: ReleaseEndpoint(
+            posixpath.join(self.url, "releases"), self._client))
 
     def webhooks(self) -> Union[CreateResourceEndpoint[Webhook, Webhook],
                                 ListResourceEndpoint[Webhook]]:
-        if self._webhooks is None:
-            self._webhooks = WebhookEndpoint(
-                posixpath.join(self.url, "webhooks"), self._client)
-        return self._webhooks
+        return _get_endpoint(self, "_webhooks", lambda: WebhookEndpoint(
+            posixpath.join(self.url, "webhooks"), self._client))
 
     def tokens(self) -> Union[CreateResourceEndpoint[CreateAccessTokenCommand, AccessToken],
                               ListResourceEndpoint[AccessToken]]:
-        if self._tokens is None:
-            self._tokens = AccessTokenEndpoint(
-                posixpath.join(self.url, "tokens"), self._client)
-        return self._tokens
+        return _get_endpoint(self, "_tokens", lambda: AccessTokenEndpoint(
+            posixpath.join(self.url, "tokens"), self._client))
 
 
 class AppEndpoint(CreateResourceEndpoint[App, App],
@@ -267,3 +410,9 @@ class Api:
         self.access_tokens = AccessTokenEndpoint("admin/access-tokens", client)
         self.webhooks: Union[GetResourceEndpoint[AccessToken],
                              DeleteResourceEndpoint] = WebhookEndpoint("admin/webhooks", client)
+
+    def deadline(self, seconds: float):
+        # Everything done in the block by the calling thread, including nested lookups such as
+        # apps.get() followed by releases().create(), must complete within the given time,
+        # or DeadlineExceededError is raised
+        return timeouts.deadline(seconds)
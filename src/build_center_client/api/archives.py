@@ -0,0 +1,291 @@
+from typing import IO, Callable, Iterator, Optional, Tuple, TypeVar
+import gzip
+import io
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+import threading
+import zipfile
+
+from .compression import _import_zstd
+from .streams import ChunkPipe
+
+
+T = TypeVar("T")
+
+
+class UnsafeArchiveError(Exception):
+    pass
+
+
+# Formats by file name suffix, and the tarfile stream mode they are read with
+_tar_modes = {
+    ".tar": "r|",
+    ".tar.gz": "r|gz",
+    ".tgz": "r|gz",
+    ".tar.bz2": "r|bz2",
+    ".tar.xz": "r|xz",
+    ".tar.zst": "r|",
+    ".tzst": "r|",
+}
+# Compressions other than gzip and zstd are left to tarfile when writing
+_tar_write_modes = {
+    ".tar.bz2": "w|bz2",
+    ".tar.xz": "w|xz",
+}
+# Zip archives smaller than this are buffered in memory rather than in a temporary file
+zip_memory_limit = 64 * 1024 * 1024
+# Timestamp of all written archive entries, so that the same content gives the same archive
+_zip_date_time = (1980, 1, 1, 0, 0, 0)
+
+
+def _check_format(format: str) -> str:
+    # Formats can be given with or without the leading dot, e.g. "tar.gz"
+    format = format if format.startswith(".") else "." + format
+    if format not in _tar_modes and format != ".zip":
+        raise Exception(f"Unsupported archive format: {format}")
+    return format
+
+
+def archive_format(name: str) -> Optional[str]:
+    name = name.lower()
+    if name.endswith(".zip"):
+        return ".zip"
+    # The longest suffix wins, e.g. ".tar.gz" over ".gz"
+    matches = [suffix for suffix in _tar_modes if name.endswith(suffix)]
+    return max(matches, key=len) if matches else None
+
+
+def _is_within(path: str, root: str) -> bool:
+    return os.path.commonpath((path, root)) == root
+
+
+def _check_tar_member(member: tarfile.TarInfo, root: str):
+    # The real path is checked so that previously extracted symlinks can't redirect members
+    target = os.path.realpath(os.path.join(root, member.name))
+    if os.path.isabs(member.name) or not _is_within(target, root):
+        raise UnsafeArchiveError(f"Archive member is outside the target directory: {member.name}")
+    if member.issym():
+        link_target = os.path.realpath(os.path.join(os.path.dirname(target), member.linkname))
+        if os.path.isabs(member.linkname) or not _is_within(link_target, root):
+            raise UnsafeArchiveError(f"Archive member links outside the target directory: {member.name}")
+    elif member.islnk():
+        link_target = os.path.realpath(os.path.join(root, member.linkname))
+        if not _is_within(link_target, root):
+            raise UnsafeArchiveError(f"Archive member links outside the target directory: {member.name}")
+    elif not (member.isfile() or member.isdir()):
+        raise UnsafeArchiveError(f"Archive member is a device or FIFO: {member.name}")
+
+
+def extract_tar_stream(stream: IO, format: str, path: str):
+    # Members are extracted in the order they are read, without seeking
+    root = os.path.realpath(path)
+    if format in (".tar.zst", ".tzst"):
+        zstd = _import_zstd()
+        if zstd is None:
+            raise Exception("Extracting zstd archives requires zstandard, install build_center_client[zstd]")
+        stream = zstd.ZstdDecompressor().stream_reader(stream)
+    # The data filter of newer Python versions applies the same checks, and also drops unsafe modes
+    extract_args = dict(filter="data") if hasattr(tarfile, "data_filter") else {}
+    with tarfile.open(fileobj=stream, mode=_tar_modes[format]) as tar:
+        for member in tar:
+            _check_tar_member(member, root)
+            tar.extract(member, root, **extract_args)
+
+
+def extract_zip(file: IO, path: str):
+    root = os.path.realpath(path)
+    with zipfile.ZipFile(file) as archive:
+        for info in archive.infolist():
+            target = os.path.realpath(os.path.join(root, info.filename))
+            if os.path.isabs(info.filename) or not _is_within(target, root):
+                raise UnsafeArchiveError(f"Archive member is outside the target directory: {info.filename}")
+            # Mode bits are only set by archivers on Unix, such as write_zip() and Info-ZIP
+            mode = info.external_attr >> 16 if info.create_system == 3 else 0
+            if stat.S_ISLNK(mode):
+                # Stored with the link target as the content, checked like symlinks in tar archives
+                # The link itself isn't resolved, an existing one is replaced rather than followed
+                link_dir = os.path.realpath(os.path.join(root, os.path.dirname(info.filename)))
+                link_path = os.path.join(link_dir, os.path.basename(info.filename))
+                link_name = archive.read(info).decode("utf-8")
+                link_target = os.path.realpath(os.path.join(link_dir, link_name))
+                if os.path.isabs(link_name) or not _is_within(link_target, root):
+                    raise UnsafeArchiveError(f"Archive member links outside the target directory: {info.filename}")
+                os.makedirs(link_dir, exist_ok=True)
+                if os.path.lexists(link_path):
+                    os.remove(link_path)
+                os.symlink(link_name, link_path)
+            elif stat.S_ISREG(mode):
+                # Like the data filter of tarfile, without setuid, setgid and write access for others
+                os.chmod(archive.extract(info, root), stat.S_IMODE(mode) & 0o755)
+            else:
+                archive.extract(info, root)
+
+
+def extract_download(download: Callable[[IO], None], format: str, path: str, size: int = None):
+    # Extracts an archive while it is being downloaded. download() writes the archive to the
+    # given file object. Zip archives have their index at the end, so they are downloaded to
+    # memory or a temporary file first.
+    format = _check_format(format)
+    os.makedirs(path, exist_ok=True)
+    if format == ".zip":
+        spool = io.BytesIO() if size is not None and size <= zip_memory_limit else tempfile.TemporaryFile()
+        with spool:
+            download(spool)
+            spool.seek(0)
+            extract_zip(spool, path)
+        return
+
+    pipe = ChunkPipe()
+    errors = []
+
+    def extract():
+        try:
+            extract_tar_stream(pipe, format, path)
+            # Read any padding after the end of the archive so that the download can finish
+            while pipe.read(1024 * 1024):
+                pass
+        except BaseException as e:
+            errors.append(e)
+            pipe.close()
+
+    extractor = threading.Thread(target=extract, name="archive-extractor", daemon=True)
+    extractor.start()
+    try:
+        download(pipe)
+    except BaseException:
+        # A failed extraction makes the download fail as well, its error is the one to report
+        if not errors:
+            pipe.close_writer()
+            extractor.join()
+            raise
+    else:
+        pipe.close_writer()
+    extractor.join()
+    if errors:
+        raise errors[0]
+
+
+class _BufferedWriter:
+    # Collects the small writes of tarfile and the compressors into larger chunks
+    def __init__(self, out: IO, size: int = 256 * 1024) -> None:
+        self._out = out
+        self._size = size
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        if len(self._buffer) >= self._size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            self._out.write(self._buffer)
+            self._buffer = bytearray()
+
+
+def _walk(path: str) -> Iterator[Tuple[str, str]]:
+    # Yields the archive name and the path of every entry below path, sorted by name.
+    # Symlinks to directories are yielded as entries but not followed.
+    for dir_path, dir_names, file_names in os.walk(path):
+        dir_names.sort()
+        for name in sorted(dir_names + file_names):
+            full_path = os.path.join(dir_path, name)
+            yield os.path.relpath(full_path, path).replace(os.sep, "/"), full_path
+
+
+def write_tar(path: str, format: str, out: IO):
+    # Entries are sorted by name and their owners and timestamps are cleared, so that the
+    # same directory content always gives the same archive
+    compressor = None
+    if format in (".tar.gz", ".tgz"):
+        compressor = out = gzip.GzipFile(filename="", mode="wb", compresslevel=6, fileobj=out, mtime=0)
+    elif format in (".tar.zst", ".tzst"):
+        zstd = _import_zstd()
+        if zstd is None:
+            raise Exception("Creating zstd archives requires zstandard, install build_center_client[zstd]")
+        compressor = out = zstd.ZstdCompressor().stream_writer(out, closefd=False)
+    mode = _tar_write_modes.get(format, "w|")
+    with tarfile.open(fileobj=out, mode=mode, format=tarfile.PAX_FORMAT) as tar:
+        for name, full_path in _walk(path):
+            info = tar.gettarinfo(full_path, name)
+            if info is None or not (info.isfile() or info.isdir() or info.issym() or info.islnk()):
+                # Sockets, devices and FIFOs are left out
+                continue
+            info.uid = info.gid = 0
+            info.uname = info.gname = ""
+            info.mtime = 0
+            if info.isfile():
+                with open(full_path, "rb") as file:
+                    tar.addfile(info, file)
+            else:
+                tar.addfile(info)
+    if compressor is not None:
+        compressor.close()
+
+
+def write_zip(path: str, out: IO):
+    # Written without seeking, the sizes and checksums follow the content of each entry
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, full_path in _walk(path):
+            st = os.lstat(full_path)
+            if stat.S_ISDIR(st.st_mode):
+                info = zipfile.ZipInfo(name + "/", _zip_date_time)
+                info.external_attr = (st.st_mode & 0xFFFF) << 16 | 0x10
+                archive.writestr(info, b"")
+            elif stat.S_ISLNK(st.st_mode):
+                # Stored like Info-ZIP does, with the link target as the content
+                info = zipfile.ZipInfo(name, _zip_date_time)
+                info.external_attr = (st.st_mode & 0xFFFF) << 16
+                archive.writestr(info, os.readlink(full_path))
+            elif stat.S_ISREG(st.st_mode):
+                info = zipfile.ZipInfo(name, _zip_date_time)
+                info.external_attr = (st.st_mode & 0xFFFF) << 16
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.file_size = st.st_size
+                with open(full_path, "rb") as file, archive.open(
+                        info, "w", force_zip64=st.st_size > zipfile.ZIP64_LIMIT) as entry:
+                    shutil.copyfileobj(file, entry, 1024 * 1024)
+
+
+def upload_directory(path: str, format: str, upload: Callable[[IO], T]) -> T:
+    # Archives a directory while it is being uploaded. The archive is written and compressed
+    # by a worker thread, and upload() reads it from the given file object as it is produced.
+    format = _check_format(format)
+    if not os.path.isdir(path):
+        raise Exception(f"Not a directory: {path}")
+    pipe = ChunkPipe()
+    errors = []
+
+    def archive():
+        try:
+            out = _BufferedWriter(pipe)
+            if format == ".zip":
+                write_zip(path, out)
+            else:
+                write_tar(path, format, out)
+            out.flush()
+        except BaseException as e:
+            errors.append(e)
+            pipe.close_writer(e)
+        else:
+            pipe.close_writer()
+
+    archiver = threading.Thread(target=archive, name="archive-writer", daemon=True)
+    archiver.start()
+    try:
+        result = upload(pipe)
+    except BaseException:
+        # A failed archiver makes the upload fail as well, its error is the one to report
+        if not errors:
+            raise
+    finally:
+        # Unblocks the archiver if the upload stopped reading
+        pipe.close()
+        archiver.join()
+    if errors:
+        raise errors[0]
+    return result
@@ -1,10 +1,10 @@
-from typing import Generic, IO, List, TypeVar
+from typing import Any, Callable, Dict, Generic, IO, Iterator, List, Optional, Tuple, TypeVar
 from dacite.config import Config
 from dacite import from_dict
 import posixpath
 from enum import Enum
-import json
 
+from . import json_backend, profiling
 from .http import ApiHttpClient
 
 
@@ -12,20 +12,38 @@ TRequest = TypeVar("TRequest")
 TResponse = TypeVar("TResponse")
 
 
+def decode_resource(response_type: TResponse, res_object: dict, res_raw: Any, client: ApiHttpClient) -> TResponse:
+    # res_raw is the resource's JSON text, or the resource already parsed from it
+    with profiling.phase("decode"):
+        resource = from_dict(data_class=response_type, data=res_object, config=Config(cast=[Enum]))
+        resource._client = client
+        resource._raw = json_backend.dumps(
+            json_backend.loads(res_raw) if isinstance(res_raw, (str, bytes)) else res_raw, indent=2)
+        return resource
+
+
+def remember_resource(client: ApiHttpClient, resource: TResponse, url: str = None) -> TResponse:
+    # Returns the instance that the client's identity map keeps for the resource, if enabled
+    identity_map = client.identity_map()
+    if identity_map is None or getattr(resource, "id", None) is None:
+        return resource
+    return identity_map.put(resource, url)
+
+
 class CreateResourceWithFileEndpoint(Generic[TResponse]):
     def __init__(self, url: str, client: ApiHttpClient, response_type: TResponse = None, **kwargs) -> None:
         self._create_with_file_url = url
         self._create_with_file_client = client
         self._create_with_file_response_type = response_type
 
-    def create_with_file(self, name: str, file: IO, **kwargs):
+    def create_with_file(self, name: str, file: IO, on_upload_data: Callable[[memoryview], None] = None,
+                         **kwargs):
         res_object, res_raw = self._create_with_file_client.post_with_files(
-            self._create_with_file_url, files={"file": (name, file)}, data=kwargs)
-        resource = from_dict(
-            data_class=self._create_with_file_response_type, data=res_object, config=Config(cast=[Enum]))
-        resource._client = self._create_with_file_client
-        resource._raw = json.dumps(json.loads(res_raw), indent=2)
-        return resource
+            self._create_with_file_url, files={"file": (name, file)}, data=kwargs,
+            on_upload_data=on_upload_data)
+        resource = decode_resource(self._create_with_file_response_type, res_object, res_raw,
+                                   self._create_with_file_client)
+        return remember_resource(self._create_with_file_client, resource)
 
 
 class CreateResourceEndpoint(Generic[TRequest, TResponse]):
@@ -40,12 +58,9 @@ class CreateResourceEndpoint(Generic[TRequest, TResponse]):
         res_object, res_raw = self._create_client.post(
             self._create_url, input_resource)
         if isinstance(res_object, str):
-            return json.dumps(json.loads(res_object), indent=2)
-        resource = from_dict(
-            data_class=self._create_response_type, data=res_object, config=Config(cast=[Enum]))
-        resource._client = self._create_client
-        resource._raw = json.dumps(json.loads(res_raw), indent=2)
-        return resource
+            return json_backend.dumps(json_backend.loads(res_object), indent=2)
+        resource = decode_resource(self._create_response_type, res_object, res_raw, self._create_client)
+        return remember_resource(self._create_client, resource)
 
 
 class UpdateResourceEndpoint(Generic[TRequest, TResponse]):
@@ -61,12 +76,9 @@ class UpdateResourceEndpoint(Generic[TRequest, TResponse]):
         res_object, res_raw = self._update_client.put(
             url, input_resource)
         if isinstance(res_object, str):
-            return json.dumps(json.loads(res_object), indent=2)
-        resource = from_dict(
-            data_class=self._update_response_type, data=res_object, config=Config(cast=[Enum]))
-        resource._client = self._update_client
-        resource._raw = json.dumps(json.loads(res_raw), indent=2)
-        return resource
+            return json_backend.dumps(json_backend.loads(res_object), indent=2)
+        resource = decode_resource(self._update_response_type, res_object, res_raw, self._update_client)
+        return remember_resource(self._update_client, resource)
 
 
 class GetResourceEndpoint(Generic[TResponse]):
@@ -77,15 +89,16 @@ class GetResourceEndpoint(Generic[TResponse]):
 
     def get(self, id: str, out_stream: IO = None) -> TResponse:
         if out_stream is None:
-            res_object, res_raw = self._get_client.get(
-                posixpath.join(self._get_url, id))
+            url = posixpath.join(self._get_url, id)
+            identity_map = self._get_client.identity_map()
+            known = None if identity_map is None else identity_map.get(self._get_response_type, id, url)
+            if known is not None:
+                return known
+            res_object, res_raw = self._get_client.get(url)
             if isinstance(res_object, str):
-                return json.dumps(json.loads(res_object), indent=2)
-            resource = from_dict(data_class=self._get_response_type,
-                                 data=res_object, config=Config(cast=[Enum]))
-            resource._client = self._get_client
-            resource._raw = json.dumps(json.loads(res_raw), indent=2)
-            return resource
+                return json_backend.dumps(json_backend.loads(res_object), indent=2)
+            resource = decode_resource(self._get_response_type, res_object, res_raw, self._get_client)
+            return remember_resource(self._get_client, resource, url)
         else:
             self._get_client.get(posixpath.join(
                 self._get_url, id), out_stream=out_stream)
@@ -98,17 +111,37 @@ class ListResourceEndpoint(Generic[TResponse]):
         self._list_response_type = response_type
 
     def list(self) -> List[TResponse]:
+        return [resource for resource in self.iter()]
+
+    def iter(self) -> Iterator[TResponse]:
+        # Resources are decoded one at a time as the caller consumes them
         res_objects, res_raws = self._list_client.get(self._list_url)
-        resources = []
-        for res_object, res_raw in zip(res_objects, json.loads(res_raws)):
-            res_raw = json.dumps(res_raw, indent=2)
-            resource = from_dict(data_class=self._list_response_type,
-                                 data=res_object,
-                                 config=Config(cast=[Enum]))
-            resource._client = self._list_client
-            resource._raw = res_raw
-            resources.append(resource)
-        return resources
+        return self._decode_list(res_objects, res_raws)
+
+    def list_if_changed(self, validators: Dict[str, str] = None) -> Tuple[Optional[List[TResponse]], Dict[str, str]]:
+        # Makes a conditional request with the validators (ETag/Last-Modified) of a previous
+        # response. Returns None instead of the resources if the list hasn't changed.
+        validators = {} if validators is None else validators
+        headers = {}
+        if "ETag" in validators:
+            headers["If-None-Match"] = validators["ETag"]
+        if "Last-Modified" in validators:
+            headers["If-Modified-Since"] = validators["Last-Modified"]
+        response_headers = {}
+        res = self._list_client.get(self._list_url, headers=headers, response_headers=response_headers)
+        if res is None:
+            return None, validators
+        response_headers = {name.lower(): value for name, value in response_headers.items()}
+        new_validators = {name: response_headers[name.lower()] for name in ("ETag", "Last-Modified")
+                          if name.lower() in response_headers}
+        return list(self._decode_list(*res)), new_validators
+
+    def _decode_list(self, res_objects: list, res_raws: str) -> Iterator[TResponse]:
+        with profiling.phase("decode"):
+            res_raws = json_backend.loads(res_raws)
+        for res_object, res_raw in zip(res_objects, res_raws):
+            resource = decode_resource(self._list_response_type, res_object, res_raw, self._list_client)
+            yield remember_resource(self._list_client, resource)
 
 
 class DeleteResourceEndpoint:
@@ -117,4 +150,9 @@ class DeleteResourceEndpoint:
         self._delete_client = client
 
     def delete(self, id: str):
-        self._delete_client.delete(posixpath.join(self._delete_url, id))
+        url = posixpath.join(self._delete_url, id)
+        self._delete_client.delete(url)
+        identity_map = self._delete_client.identity_map()
+        if identity_map is not None:
+            # The same URL could have been used to read the resource, e.g. with its name
+            identity_map.remove(id, url)
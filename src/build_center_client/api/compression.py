@@ -0,0 +1,51 @@
+from typing import List
+import gzip
+import zlib
+
+
+def _import_brotli():
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        pass
+    try:
+        import brotlicffi
+        return brotlicffi
+    except ImportError:
+        return None
+
+
+def _import_zstd():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+def available_encodings() -> List[str]:
+    # Ordered by preference
+    encodings = []
+    if _import_zstd() is not None:
+        encodings.append("zstd")
+    if _import_brotli() is not None:
+        encodings.append("br")
+    encodings.extend(("gzip", "deflate"))
+    return encodings
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if encoding == "deflate":
+        return zlib.compress(data)
+    if encoding == "br":
+        brotli = _import_brotli()
+        if brotli is not None:
+            return brotli.compress(data, quality=5)
+    if encoding == "zstd":
+        zstd = _import_zstd()
+        if zstd is not None:
+            return zstd.ZstdCompressor(level=3).compress(data)
+    raise Exception(f"Unsupported content encoding: {encoding}")
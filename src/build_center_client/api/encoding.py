@@ -1,29 +1,51 @@
 from dataclasses import asdict
 from enum import Enum
+from typing import Sequence
 import humps
-import json
+
+from . import json_backend, profiling
 
 
 class ApiJsonEncoder:
     @staticmethod
-    def encode(data, level: int = 0):
+    def encode(data, level: int = 0, fields: Sequence[str] = None):
+        def convert(value):
+            # Use value of enum object
+            if isinstance(value, Enum):
+                return value.value
+            # Convert all elements of a tuple
+            if isinstance(value, tuple):
+                return tuple(convert(v) for v in value)
+            # Convert all elements of a list
+            if isinstance(value, list):
+                return [convert(v) for v in value]
+            return value
+
         def dict_factory(entries):
-            def convert(value):
-                # Use value of enum object
-                if isinstance(value, Enum):
-                    return value.value
-                # Convert all elements of a tuple
-                if isinstance(value, tuple):
-                    return tuple(convert(v) for v in value)
-                # Convert all elements of a list
-                if isinstance(value, list):
-                    return [convert(v) for v in value]
-                return value
             # Remove "private" properties based on property name prefix
             return dict([(k, convert(v)) for (k, v) in entries if not k.startswith("_")])
-        if isinstance(data, tuple) or isinstance(data, list):
-            data = tuple(ApiJsonEncoder.encode(d, level + 1) for d in data)
-        else:
-            data = None if data is None else humps.camelize(
-                asdict(data, dict_factory=dict_factory)) if not isinstance(data, dict) else data
-        return json.dumps(data, indent=2) if level == 0 else data
+
+        def project(data):
+            # Only the requested fields are converted, which is cheaper than asdict()
+            projection = {}
+            for field in fields:
+                name = humps.decamelize(field)
+                if name.startswith("_") or not hasattr(data, name):
+                    raise Exception(f"Unknown field: {field}")
+                value = getattr(data, name)
+                projection[name] = convert(dict(value) if isinstance(value, dict) else value)
+            return projection
+
+        with profiling.phase("encode"):
+            if isinstance(data, tuple) or isinstance(data, list):
+                data = tuple(ApiJsonEncoder.encode(d, level + 1, fields) for d in data)
+            elif data is not None and not isinstance(data, dict):
+                data = humps.camelize(project(data) if fields is not None else
+                                      asdict(data, dict_factory=dict_factory))
+            return json_backend.dumps(data, indent=2) if level == 0 else data
+
+    @staticmethod
+    def encode_line(data, fields: Sequence[str] = None) -> str:
+        # Compact single-line JSON, e.g. for NDJSON output
+        with profiling.phase("encode"):
+            return json_backend.dumps_compact(ApiJsonEncoder.encode(data, 1, fields)).decode("utf-8")
@@ -1,15 +1,39 @@
-from typing import Any, Dict, IO, Tuple, Union
-import requests
+from typing import Any, Callable, Dict, IO, Optional, Tuple, Union
+import copy
 from dataclasses import asdict, dataclass
 import posixpath
 import humps
 import re
 from enum import Enum
 import logging
+import os
+import threading
+import time
+import weakref
+
+from . import json_backend, profiling
+from .compression import compress
+from .indexes import IdentityMap
+from .streams import MultipartBody, preallocate, truncate_preallocated
+from .throttle import TokenBucket
+from .timeouts import DeadlineExceededError, RequestTimeoutError, check_deadline, remaining_time
+from .transport import Http2Transport, RequestsTransport, Timeout, Transport
 
 
 logger = logging.getLogger("buildcenter.common.http")
 
+# Clients that need to drop their connections and locks in forked child processes
+_clients = weakref.WeakSet()
+
+
+def _reset_clients_after_fork():
+    for client in list(_clients):
+        client._reset_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_clients_after_fork)
+
 
 def diff_dicts(first: dict, second: dict) -> dict:
     first_items = set(first.items())
@@ -61,11 +85,100 @@ def is_same_content_type(first: Union[str, ContentType], second: Union[str, Cont
     return first == second
 
 
+@dataclass
+class ClientStats:
+    # GET requests that were sent to the server
+    requests: int = 0
+    # GET requests that were answered by an identical request already in flight
+    coalesced: int = 0
+    # JSON request bodies before and after content encoding
+    request_bytes: int = 0
+    request_bytes_sent: int = 0
+    # JSON response bodies after and before content decoding
+    response_bytes: int = 0
+    response_bytes_received: int = 0
+
+
+class _InFlightRequest:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # Threads waiting for the result, only changed while the request is in flight
+        self.followers = 0
+
+
 class ApiHttpClient:
-    def __init__(self, base_url: str, token: str = None, proxy_address: str = None) -> None:
+    # Safe for concurrent use from multiple threads, and from processes forked after the
+    # client was created. A forked child gets its own connections.
+    # Requests are bounded by the connect and read timeouts, and by the deadline set with
+    # timeouts.deadline() in the calling thread.
+    def __init__(self, base_url: str, token: str = None, proxy_address: str = None,
+                 coalesce_requests: bool = True, transport: Transport = None,
+                 http2: bool = False, request_compression: str = "gzip",
+                 request_compression_threshold: int = None, pool_size: int = None,
+                 connect_timeout: float = None, read_timeout: float = None,
+                 identity_map_ttl: float = None, upload_rate_limit: float = None,
+                 download_rate_limit: float = None) -> None:
         self._base_url = base_url
         self._token = token
         self._proxy_address = proxy_address
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        if transport is None:
+            transport = Http2Transport() if http2 else RequestsTransport(pool_size=pool_size)
+        self._transport = transport
+        self._accept_encoding = ", ".join(transport.accept_encodings())
+        # Request bodies are only compressed when the server is known to accept it
+        self._request_compression = request_compression
+        self._request_compression_threshold = request_compression_threshold
+        self._coalesce_requests = coalesce_requests
+        self._in_flight: Dict[Tuple[str, str], _InFlightRequest] = {}
+        self._lock = threading.Lock()
+        self._stats = ClientStats()
+        self._session_objects: Dict[Any, Any] = {}
+        self._identity_map_ttl = identity_map_ttl
+        # Bytes per second of asset content, shared by all concurrent transfers of the client
+        self._upload_bucket = None if upload_rate_limit is None else TokenBucket(upload_rate_limit)
+        self._download_bucket = None if download_rate_limit is None else TokenBucket(download_rate_limit)
+        _clients.add(self)
+
+    def __deepcopy__(self, memo):
+        # The client holds shared connection state and is referenced by resources,
+        # so it must not be copied, e.g. by dataclasses.asdict()
+        return self
+
+    def close(self):
+        self._transport.close()
+
+    def _reset_after_fork(self):
+        # Other threads of the parent don't exist in the child, so locks they held would
+        # never be released and requests they had in flight would never complete
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._session_objects = {}
+        for bucket in (self._upload_bucket, self._download_bucket):
+            if bucket is not None:
+                bucket.reset_after_fork()
+        self._transport.reset()
+
+    def session_object(self, key: Any, factory: Callable[[], Any]) -> Any:
+        # Objects that live as long as the client, such as indexes shared between endpoints
+        with self._lock:
+            obj = self._session_objects.get(key)
+            if obj is None:
+                obj = self._session_objects[key] = factory()
+            return obj
+
+    def identity_map(self) -> Optional[IdentityMap]:
+        # Shared by all endpoints of the client, if enabled with identity_map_ttl
+        if self._identity_map_ttl is None:
+            return None
+        return self.session_object(IdentityMap, lambda: IdentityMap(self._identity_map_ttl))
+
+    def stats(self) -> ClientStats:
+        with self._lock:
+            return ClientStats(**asdict(self._stats))
 
     def dict_factory(self, entries):
         def convert(value):
@@ -84,10 +197,14 @@ class ApiHttpClient:
 
     def request(self, method: str, url: str, accept: str, content_type: str = None,
                 data: Any = None, files: Dict[str, Tuple[str, IO]] = None,
-                out_stream: IO = None) -> any:
-        headers = {}
+                out_stream: IO = None, out_stream_size: int = None,
+                on_upload_data: Callable[[memoryview], None] = None,
+                headers: Dict[str, str] = None, response_headers: Dict[str, str] = None,
+                on_download_data: Callable[[memoryview], None] = None) -> any:
+        headers = {} if headers is None else dict(headers)
         self._add_authorization_header(headers)
         self._add_accept_header(accept, headers)
+        headers["Accept-Encoding"] = self._accept_encoding
         json_data = None
         if files is None:
             content_type = self._add_content_type_header(
@@ -106,35 +223,79 @@ class ApiHttpClient:
             "https": f"https://{self._proxy_address}"
         }
         logger.debug("> %s %s %s", method, url, json_data)
-        r = requests.request(method, url, headers=headers,
-                             json=json_data, data=data, files=files, proxies=proxies,
-                             stream=out_stream is not None)
-        logger.debug("< %s", r.content)
-        if r.status_code == 400:
-            raise Exception("Bad request")
-        if r.status_code == 401:
-            raise Exception("Unauthorized")
-        if r.status_code == 403:
-            raise Exception("Forbidden")
-        if r.status_code == 404:
-            raise Exception("Not found")
-        if "Content-Type" in r.headers:
-            response_content_type = ContentType.parse(
-                r.headers["Content-Type"])
-            if response_content_type is not None and accept is not None and not is_same_content_type(response_content_type, accept):
-                raise Exception("Received content with unexpected type")
-            if out_stream is not None:
-                for chunk in r.iter_content(chunk_size=1024*1024):
-                    if chunk:
-                        out_stream.write(chunk)
+        if json_data is not None:
+            data = self._encode_json_body(json_data, headers)
+        timeout = self._get_timeout()
+        body = None
+        if files is not None:
+            # Files are streamed from memory-mapped views instead of being read into memory
+            body = MultipartBody(files, data, on_file_data=self._wrap_upload_data_callback(on_upload_data))
+            if self._upload_bucket is not None:
+                body.chunk_size = self._upload_bucket.chunk_size
+            headers["Content-Type"] = body.content_type
+            if body.length is not None:
+                headers["Content-Length"] = str(body.length)
+                data = body
+            else:
+                # Streamed files have no known length, the body is sent with chunked encoding
+                data = iter(body)
+        started_at = time.perf_counter()
+        try:
+            r = self._transport.request(method, url, headers=headers, data=data, proxies=proxies,
+                                        stream=out_stream is not None, timeout=timeout)
+        except Exception as e:
+            self._profile_request(method, url, started_at)
+            # Report the deadline rather than the timeout if it was what cut the request short
+            if isinstance(e, RequestTimeoutError):
+                check_deadline()
+            raise
+        finally:
+            if body is not None:
+                body.close()
+        # Streamed responses hold their connection until they are closed, which
+        # _read_into_stream() does once it has them
+        streamed = False
+        try:
+            if out_stream is None:
+                self._profile_request(method, url, started_at, r)
+                logger.debug("< %s", r.content)
+            if response_headers is not None:
+                response_headers.update(r.headers)
+            if r.status_code == 304:
+                # Not modified since the validators given in the request headers
                 return None
-            elif response_content_type.mime == "application/json":
-                response_json = r.json()
-                check_response_body_for_error(response_json)
-                return (humps.decamelize(response_json), r.text)
+            if r.status_code == 400:
+                raise Exception("Bad request")
+            if r.status_code == 401:
+                raise Exception("Unauthorized")
+            if r.status_code == 403:
+                raise Exception("Forbidden")
+            if r.status_code == 404:
+                raise Exception("Not found")
+            if "Content-Type" in r.headers:
+                response_content_type = ContentType.parse(
+                    r.headers["Content-Type"])
+                if response_content_type is not None and accept is not None and not is_same_content_type(response_content_type, accept):
+                    raise Exception("Received content with unexpected type")
+                if out_stream is not None:
+                    streamed = True
+                    size = self._read_into_stream(r, out_stream, out_stream_size, on_download_data)
+                    self._profile_request(method, url, started_at, r, size)
+                    return None
+                elif response_content_type.mime == "application/json":
+                    with profiling.phase("decode"):
+                        response_json = json_backend.loads(r.content)
+                        self._add_stats(response_bytes=len(r.content),
+                                        response_bytes_received=self._transport.bytes_received(r))
+                        check_response_body_for_error(response_json)
+                        return (humps.decamelize(response_json), r.text)
+        finally:
+            if out_stream is not None and not streamed:
+                r.close()
 
-    def post_with_files(self, url: str, files: Dict[str, Tuple[str, IO]], data: Any = None, accept: str = None) -> str:
-        return self.request("POST", url, accept, data=data, files=files)
+    def post_with_files(self, url: str, files: Dict[str, Tuple[str, IO]], data: Any = None, accept: str = None,
+                        on_upload_data: Callable[[memoryview], None] = None) -> str:
+        return self.request("POST", url, accept, data=data, files=files, on_upload_data=on_upload_data)
 
     def post(self, url: str, data: Any, accept: str = None) -> str:
         return self.request("POST", url, accept, data=data)
@@ -145,12 +306,151 @@ class ApiHttpClient:
     def patch(self, url: str, data: Any, accept: str = None) -> str:
         return self.request("PATCH", url, accept, data=data)
 
-    def get(self, url: str, accept: str = None, out_stream: IO = None) -> str:
-        return self.request("GET", url, accept, out_stream=out_stream)
+    def get(self, url: str, accept: str = None, out_stream: IO = None,
+            out_stream_size: int = None, headers: Dict[str, str] = None,
+            response_headers: Dict[str, str] = None,
+            on_download_data: Callable[[memoryview], None] = None) -> str:
+        if out_stream is not None or headers or response_headers is not None \
+                or not self._coalesce_requests:
+            return self.request("GET", url, accept, out_stream=out_stream,
+                                out_stream_size=out_stream_size, headers=headers,
+                                response_headers=response_headers,
+                                on_download_data=on_download_data)
+        return self._coalesced_get(url, accept)
 
     def delete(self, url: str, accept: str = None) -> None:
         self.request("DELETE", url, accept)
 
+    def _read_into_stream(self, r: Any, out_stream: IO, size: int = None,
+                          on_data: Callable[[memoryview], None] = None) -> int:
+        # A single buffer is reused for the whole download
+        preallocated = preallocate(out_stream, size)
+        buffer = memoryview(bytearray(1024*1024))
+        bucket = self._download_bucket
+        if bucket is not None:
+            buffer = buffer[:bucket.chunk_size]
+        written = 0
+        try:
+            while True:
+                check_deadline()
+                try:
+                    length = self._transport.readinto(r, buffer)
+                except RequestTimeoutError:
+                    check_deadline()
+                    raise
+                if not length:
+                    break
+                out_stream.write(buffer[:length])
+                written += length
+                if bucket is not None:
+                    self._throttle(bucket, length)
+                if on_data is not None:
+                    on_data(buffer[:length])
+        finally:
+            r.close()
+            # Also after a failed download, so that the file doesn't keep the full size
+            if preallocated:
+                truncate_preallocated(out_stream)
+        return written
+
+    def _profile_request(self, method: str, url: str, started_at: float, r: Any = None,
+                         size: int = None):
+        profile = profiling.active()
+        if profile is None:
+            return
+        if r is not None and size is None:
+            size = self._transport.bytes_received(r)
+        profile.add_request(profiling.RequestTiming(
+            method.upper(), url, None if r is None else r.status_code,
+            time.perf_counter() - started_at, size))
+
+    def _get_timeout(self) -> Timeout:
+        # The timeouts are shortened to the time left until the deadline
+        check_deadline()
+        remaining = remaining_time()
+        if remaining is None:
+            return (self._connect_timeout, self._read_timeout)
+        return tuple(remaining if timeout is None else min(timeout, remaining)
+                     for timeout in (self._connect_timeout, self._read_timeout))
+
+    def _wrap_upload_data_callback(self, on_data: Callable[[memoryview], None] = None):
+        # File content is passed through the callback right before it is sent
+        bucket = self._upload_bucket
+        if bucket is None and remaining_time() is None:
+            return on_data
+
+        def on_upload_data(data: memoryview):
+            check_deadline()
+            if bucket is not None:
+                self._throttle(bucket, len(data))
+            if on_data is not None:
+                on_data(data)
+        return on_upload_data
+
+    def _throttle(self, bucket: TokenBucket, size: int):
+        wait = bucket.reserve(size)
+        if wait <= 0:
+            return
+        remaining = remaining_time()
+        if remaining is not None and wait > remaining:
+            time.sleep(max(remaining, 0))
+            raise DeadlineExceededError("Deadline exceeded")
+        time.sleep(wait)
+
+    def _encode_json_body(self, json_data: Any, headers: dict) -> bytes:
+        body = json_backend.dumps_compact(json_data)
+        body_size = len(body)
+        threshold = self._request_compression_threshold
+        if threshold is not None and body_size >= threshold:
+            body = compress(body, self._request_compression)
+            headers["Content-Encoding"] = self._request_compression
+        self._add_stats(request_bytes=body_size, request_bytes_sent=len(body))
+        return body
+
+    def _add_stats(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self._stats, name, getattr(self._stats, name) + value)
+
+    def _coalesced_get(self, url: str, accept: str = None):
+        # Identical concurrent GET requests share the result of the first one
+        key = (url, accept)
+        while True:
+            with self._lock:
+                in_flight = self._in_flight.get(key)
+                is_leader = in_flight is None
+                if is_leader:
+                    in_flight = _InFlightRequest()
+                    self._in_flight[key] = in_flight
+                    self._stats.requests += 1
+                else:
+                    in_flight.followers += 1
+                    self._stats.coalesced += 1
+            if is_leader:
+                break
+            # The request is sent by another thread, so this thread's deadline must be checked here
+            if not in_flight.done.wait(remaining_time()):
+                raise DeadlineExceededError("Deadline exceeded")
+            # The leader's own deadline doesn't apply to this thread, which tries again,
+            # possibly as the new leader
+            if isinstance(in_flight.error, DeadlineExceededError):
+                continue
+            if in_flight.error is not None:
+                raise in_flight.error
+            # Callers may modify the decoded data so each gets its own copy
+            return copy.deepcopy(in_flight.result)
+        try:
+            in_flight.result = self.request("GET", url, accept)
+        except Exception as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.done.set()
+        # No more followers can join once the request is removed, without any the result isn't shared
+        return copy.deepcopy(in_flight.result) if in_flight.followers else in_flight.result
+
     def _add_authorization_header(self, headers: dict):
         if self._token:
             headers["Authorization"] = f"Bearer {self._token}"
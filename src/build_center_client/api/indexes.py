@@ -0,0 +1,242 @@
+from collections import defaultdict
+from dataclasses import fields
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import bisect
+import threading
+import time
+import weakref
+
+from .semver import Version, VersionConstraint
+
+
+class AssetTagIndex:
+    # Inverted index from asset tags to assets. Assets are grouped by scope, which is the
+    # URL they were listed from, e.g. the assets of one release.
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._assets: Dict[str, Any] = {}
+        # The JSON and tags of each asset as they were indexed, as the asset objects can be
+        # updated in place through the identity map
+        self._indexed: Dict[str, Tuple[str, Dict[str, Optional[str]]]] = {}
+        self._positions: Dict[str, int] = {}
+        self._next_position = 0
+        self._scopes: Dict[str, Set[str]] = {}
+        self._by_tag: Dict[Tuple[str, Optional[str]], Set[str]] = defaultdict(set)
+        self._by_key: Dict[str, Set[str]] = defaultdict(set)
+
+    def has_scope(self, scope: str) -> bool:
+        with self._lock:
+            return scope in self._scopes
+
+    def refresh(self, scope: str, assets: Iterable[Any]):
+        # Only assets that are new, changed or gone are re-indexed
+        with self._lock:
+            old_ids = self._scopes.get(scope, set())
+            new_ids = set()
+            for asset in assets:
+                new_ids.add(asset.id)
+                indexed = self._indexed.get(asset.id)
+                if indexed is None or indexed[0] != asset.raw():
+                    self._add(asset)
+            for id in old_ids - new_ids:
+                self._remove(id)
+            self._scopes[scope] = new_ids
+
+    def add(self, scope: str, asset: Any):
+        with self._lock:
+            if scope in self._scopes:
+                self._add(asset)
+                self._scopes[scope].add(asset.id)
+
+    def remove(self, id: str):
+        with self._lock:
+            self._remove(id)
+            for ids in self._scopes.values():
+                ids.discard(id)
+
+    def find(self, tags: Dict[str, Optional[str]], scope: str) -> List[Any]:
+        # A tag without a value matches any asset that has the tag
+        with self._lock:
+            candidates = [self._scopes.get(scope, set())]
+            for key, value in tags.items():
+                candidates.append(self._by_key.get(key, set()) if value is None
+                                  else self._by_tag.get((key, value), set()))
+            candidates.sort(key=len)
+            ids = set(candidates[0])
+            for other in candidates[1:]:
+                if not ids:
+                    break
+                ids.intersection_update(other)
+            return [self._assets[id] for id in sorted(ids, key=self._positions.get)]
+
+    def _add(self, asset: Any):
+        self._remove(asset.id)
+        tags = dict(asset.tags or {})
+        self._assets[asset.id] = asset
+        self._indexed[asset.id] = (asset.raw(), tags)
+        self._positions[asset.id] = self._next_position
+        self._next_position += 1
+        for key, value in tags.items():
+            self._by_tag[(key, value)].add(asset.id)
+            self._by_key[key].add(asset.id)
+
+    def _remove(self, id: str):
+        if self._assets.pop(id, None) is None:
+            return
+        _, tags = self._indexed.pop(id)
+        del self._positions[id]
+        for key, value in tags.items():
+            self._discard(self._by_tag, (key, value), id)
+            self._discard(self._by_key, key, id)
+
+    @staticmethod
+    def _discard(index: Dict[Any, Set[str]], key: Any, id: str):
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(id)
+            if not ids:
+                del index[key]
+
+
+class ReleaseVersionIndex:
+    # Releases ordered by semantic version. Releases are grouped by scope, which is the URL
+    # they were listed from, e.g. the releases of one app.
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._releases: Dict[str, Any] = {}
+        # The JSON of each release as it was indexed, see AssetTagIndex
+        self._raws: Dict[str, str] = {}
+        self._versions: Dict[str, Version] = {}
+        self._scopes: Dict[str, List[Tuple[Any, str]]] = {}
+
+    def has_scope(self, scope: str) -> bool:
+        with self._lock:
+            return scope in self._scopes
+
+    def refresh(self, scope: str, releases: Iterable[Any]):
+        # Only versions of releases that are new or changed are parsed again
+        with self._lock:
+            entries = []
+            for release in releases:
+                if self._raws.get(release.id) != release.raw():
+                    self._set(release)
+                version = self._versions.get(release.id)
+                if version is not None:
+                    entries.append((version.key, release.id))
+            entries.sort()
+            self._scopes[scope] = entries
+
+    def put(self, release: Any, scope: str = None):
+        # Updates a known release in every scope, and adds it to the given scope if it's loaded
+        with self._lock:
+            scopes = [name for name, entries in self._scopes.items()
+                      if name == scope or any(entry[1] == release.id for entry in entries)]
+            self._remove_from_scopes(release.id)
+            self._set(release)
+            version = self._versions.get(release.id)
+            if version is None:
+                return
+            for name in scopes:
+                bisect.insort(self._scopes[name], (version.key, release.id))
+
+    def remove(self, id: str):
+        with self._lock:
+            self._remove_from_scopes(id)
+            self._releases.pop(id, None)
+            self._raws.pop(id, None)
+            self._versions.pop(id, None)
+
+    def resolve(self, scope: str, constraint: str = None, prerelease: bool = False,
+                published: Optional[bool] = True) -> Optional[Any]:
+        # Walks from the newest version down and returns the first release that matches
+        constraint = None if constraint is None else VersionConstraint(constraint)
+        with self._lock:
+            for _, id in reversed(self._scopes.get(scope, ())):
+                release = self._releases[id]
+                version = self._versions[id]
+                if not prerelease and (release.prerelease or version.prerelease):
+                    continue
+                if published is not None and release.published != published:
+                    continue
+                if constraint is not None and not constraint.matches(version):
+                    continue
+                return release
+            return None
+
+    def _set(self, release: Any):
+        self._releases[release.id] = release
+        self._raws[release.id] = release.raw()
+        version = Version.parse(release.version or "")
+        # Releases without a valid semantic version are not indexed
+        if version is None:
+            self._versions.pop(release.id, None)
+        else:
+            self._versions[release.id] = version
+
+    def _remove_from_scopes(self, id: str):
+        for scope, entries in self._scopes.items():
+            self._scopes[scope] = [entry for entry in entries if entry[1] != id]
+
+
+class IdentityMap:
+    # Keeps a single instance per resource, so that reads through different endpoints, e.g.
+    # App.releases() and Api.releases, return the same object. Resources are keyed by type
+    # and ID, and also by the URLs they were read from, as those can contain names instead
+    # of IDs. Resources that were read within the TTL are returned without fetching them
+    # again. After that they are only kept as long as the application references them.
+    def __init__(self, ttl: float) -> None:
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._instances = weakref.WeakValueDictionary()
+        self._fresh: Dict[Tuple[type, str], Tuple[float, Any]] = {}
+        self._aliases: Dict[str, Tuple[type, str]] = {}
+        self._next_purge = 0
+
+    def get(self, type_: type, id: str, url: str = None) -> Optional[Any]:
+        with self._lock:
+            key = self._aliases.get(url, (type_, id))
+            entry = self._fresh.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            return entry[1]
+
+    def put(self, resource: Any, url: str = None) -> Any:
+        # Returns the known instance of the resource updated in place, or the given one if
+        # the resource isn't known yet
+        key = (type(resource), resource.id)
+        now = time.monotonic()
+        with self._lock:
+            instance = self._instances.get(key)
+            if instance is None:
+                instance = self._instances[key] = resource
+            elif instance is not resource:
+                self._update(instance, resource)
+            self._fresh[key] = (now + self._ttl, instance)
+            if url is not None:
+                self._aliases[url] = key
+            if now >= self._next_purge:
+                self._purge(now)
+        return instance
+
+    def remove(self, id: str, url: str = None):
+        with self._lock:
+            keys = {key for key in self._instances.keys() if key[1] == id}
+            if url in self._aliases:
+                keys.add(self._aliases[url])
+            for key in keys:
+                self._instances.pop(key, None)
+                self._fresh.pop(key, None)
+            self._aliases = {alias: key for alias, key in self._aliases.items() if key not in keys}
+
+    def _update(self, instance: Any, resource: Any):
+        for field in fields(resource):
+            value = getattr(resource, field.name)
+            # Private state that the new copy doesn't have, such as nested endpoints, is kept
+            if field.name.startswith("_") and value is None:
+                continue
+            setattr(instance, field.name, value)
+
+    def _purge(self, now: float):
+        self._fresh = {key: entry for key, entry in self._fresh.items() if entry[0] > now}
+        self._aliases = {alias: key for alias, key in self._aliases.items() if key in self._fresh}
+        self._next_purge = now + self._ttl
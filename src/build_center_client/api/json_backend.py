@@ -0,0 +1,70 @@
+from typing import IO, Any, Union
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# orjson writes float exponents as "1e16" while the json module writes "1e+16"
+_orjson_float_exponent = re.compile(r"e-?[0-9]+(?=[,\n]|$)")
+
+
+def _has_non_finite(data: Any) -> bool:
+    # orjson writes NaN and Infinity as null, while the json module keeps them
+    pending = [data]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, float):
+            # NaN for NaN and both infinities, cheaper than math.isfinite()
+            if value - value != 0:
+                return True
+        elif isinstance(value, dict):
+            pending.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            pending.extend(value)
+    return False
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # The json module accepts a few non-standard values such as NaN
+            pass
+    return json.loads(data)
+
+
+def load(io: IO) -> Any:
+    return loads(io.read())
+
+
+def dumps(data: Any, indent: int = None) -> str:
+    # The output is identical to json.dumps(), so it can be used for printing
+    if orjson is not None and indent == 2:
+        try:
+            encoded = orjson.dumps(data, option=orjson.OPT_INDENT_2).decode("utf-8")
+        except TypeError:
+            encoded = None
+        # The json module escapes non-ASCII characters, and formats float exponents differently
+        if encoded is not None and encoded.isascii() and "\x7f" not in encoded \
+                and _orjson_float_exponent.search(encoded) is None \
+                and ("null" not in encoded or not _has_non_finite(data)):
+            return encoded
+    return json.dumps(data, indent=indent)
+
+
+def dumps_compact(data: Any) -> bytes:
+    # The output is compact JSON encoded as UTF-8, meant to be sent over the wire
+    if orjson is not None:
+        try:
+            encoded = orjson.dumps(data)
+        except TypeError:
+            encoded = None
+        # Only scanned for NaN and Infinity when there is a null, which is rare in requests
+        if encoded is not None and (b"null" not in encoded or not _has_non_finite(data)):
+            return encoded
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
@@ -0,0 +1,102 @@
+from dataclasses import dataclass
+from typing import IO, Dict, List, Optional
+import threading
+import time
+
+
+@dataclass
+class RequestTiming:
+    method: str
+    url: str
+    status: Optional[int]
+    seconds: float
+    size: Optional[int] = None
+
+
+class Profile:
+    # Wall-clock time spent in each phase of a command, and the timing of each HTTP request.
+    # Phases of concurrent threads overlap, so their sum can exceed the total time.
+    def __init__(self, started_at: float = None) -> None:
+        self.started_at = time.perf_counter() if started_at is None else started_at
+        self._lock = threading.Lock()
+        self.phases: Dict[str, float] = {}
+        self.requests: List[RequestTiming] = []
+
+    def add_phase(self, name: str, seconds: float):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def add_request(self, timing: RequestTiming):
+        with self._lock:
+            self.requests.append(timing)
+            self.phases["network"] = self.phases.get("network", 0) + timing.seconds
+
+    def report(self, out: IO):
+        total = time.perf_counter() - self.started_at
+        with self._lock:
+            phases = dict(self.phases)
+            requests = list(self.requests)
+        phases["other"] = max(total - sum(phases.values()), 0)
+        out.write(f"Profile: {total * 1000:.1f} ms total\n")
+        for name, seconds in phases.items():
+            out.write(f"  {name:<10}{seconds * 1000:>10.1f} ms{seconds * 100 / total:>6.1f} %\n")
+        if requests:
+            out.write(f"Requests: {len(requests)}\n")
+        for request in requests:
+            status = "error" if request.status is None else request.status
+            size = "" if request.size is None else f"{request.size} B"
+            out.write(f"  {request.seconds * 1000:>10.1f} ms{size:>14}  {status:<5} {request.method:<6} {request.url}\n")
+        out.flush()
+
+
+class _Phase:
+    def __init__(self, profile: Profile, name: str) -> None:
+        self._profile = profile
+        self._name = name
+        self._started_at = None
+
+    def __enter__(self):
+        # A phase that is entered again in the same thread, e.g. by recursion, is only counted once
+        active = _local.__dict__.setdefault("active", set())
+        if self._name not in active:
+            active.add(self._name)
+            self._started_at = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self._started_at is not None:
+            _local.active.discard(self._name)
+            self._profile.add_phase(self._name, time.perf_counter() - self._started_at)
+
+
+class _NoPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_local = threading.local()
+_no_phase = _NoPhase()
+_profile: Optional[Profile] = None
+
+
+def start(started_at: float = None) -> Profile:
+    global _profile
+    _profile = Profile(started_at)
+    return _profile
+
+
+def stop():
+    global _profile
+    _profile = None
+
+
+def active() -> Optional[Profile]:
+    return _profile
+
+
+def phase(name: str):
+    # Costs next to nothing unless profiling has been started
+    profile = _profile
+    return _no_phase if profile is None else _Phase(profile, name)
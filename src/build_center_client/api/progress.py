@@ -0,0 +1,68 @@
+from dataclasses import dataclass
+from typing import Callable, Optional
+import time
+
+
+@dataclass
+class Progress:
+    done: int
+    total: Optional[int]
+    elapsed: float
+    # Bytes per second since the previous report, and since the start
+    rate: float
+    average_rate: float
+    # Estimated seconds until done, if the total is known and data is flowing
+    eta: Optional[float]
+    finished: bool = False
+
+
+class ProgressTracker:
+    # Counts transferred bytes and reports the progress at most once per interval, plus once
+    # when finished. update() is called for every chunk, so it only counts and checks the time.
+    def __init__(self, on_progress: Callable[[Progress], None], total: int = None,
+                 interval: float = 0.25) -> None:
+        self._on_progress = on_progress
+        self._total = total
+        self._interval = interval
+        self._done = 0
+        self._started_at = time.monotonic()
+        self._reported_at = self._started_at
+        self._reported_done = 0
+        self._next_report = self._started_at + interval
+
+    def update(self, data: memoryview):
+        self._done += len(data)
+        now = time.monotonic()
+        if now >= self._next_report:
+            self._report(now)
+
+    def finish(self):
+        self._report(time.monotonic(), finished=True)
+
+    def _report(self, now: float, finished: bool = False):
+        elapsed = now - self._started_at
+        window = now - self._reported_at
+        rate = (self._done - self._reported_done) / window if window > 0 else 0.0
+        average_rate = self._done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if finished:
+            eta = 0.0
+        elif self._total is not None and rate > 0:
+            eta = max(self._total - self._done, 0) / rate
+        self._reported_at = now
+        self._reported_done = self._done
+        self._next_report = now + self._interval
+        self._on_progress(Progress(self._done, self._total, elapsed, rate, average_rate, eta,
+                                   finished))
+
+
+def chain_callbacks(*callbacks: Optional[Callable[[memoryview], None]]) -> Optional[Callable[[memoryview], None]]:
+    # Combines data callbacks such as ProgressTracker.update() and UploadDigest.update()
+    callbacks = [callback for callback in callbacks if callback is not None]
+    if len(callbacks) <= 1:
+        return callbacks[0] if callbacks else None
+
+    def on_data(data: memoryview):
+        for callback in callbacks:
+            callback(data)
+    return on_data
@@ -0,0 +1,62 @@
+from typing import Any, Callable, List, Optional, Tuple
+import operator
+import re
+
+
+_version_pattern = re.compile(
+    r"^v?(\d+)(?:\.(\d+))?(?:\.(\d+))?(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?$")
+_clause_pattern = re.compile(r"^(>=|<=|==|!=|>|<|=)?\s*(\S+)$")
+_operators = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    "==": operator.eq,
+    "=": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+
+
+class Version:
+    # Semantic version, where missing minor and patch numbers count as 0
+    def __init__(self, major: int, minor: int, patch: int, prerelease: Tuple[str, ...] = ()) -> None:
+        self.major = major
+        self.minor = minor
+        self.patch = patch
+        self.prerelease = prerelease
+        # Precedence as defined by semver: a pre-release sorts before its release, and
+        # numeric identifiers sort before alphanumeric ones
+        self.key = (major, minor, patch,
+                    (1,) if not prerelease else (0,) + tuple(
+                        (0, int(part), "") if part.isdigit() else (1, 0, part) for part in prerelease))
+
+    @staticmethod
+    def parse(value: str) -> Optional["Version"]:
+        match = _version_pattern.match(value.strip())
+        if match is None:
+            return None
+        major, minor, patch, prerelease = match.groups()
+        return Version(int(major), int(minor or 0), int(patch or 0),
+                       tuple(prerelease.split(".")) if prerelease else ())
+
+    def __str__(self) -> str:
+        version = f"{self.major}.{self.minor}.{self.patch}"
+        return f"{version}-{'.'.join(self.prerelease)}" if self.prerelease else version
+
+
+class VersionConstraint:
+    # Comma-separated comparisons that must all match, e.g. ">=1.2,<2"
+    def __init__(self, value: str) -> None:
+        self._clauses: List[Tuple[Callable[[Any, Any], bool], Version]] = []
+        for clause in value.split(","):
+            clause = clause.strip()
+            if not clause:
+                continue
+            match = _clause_pattern.match(clause)
+            version = None if match is None else Version.parse(match.group(2))
+            if version is None:
+                raise Exception(f"Invalid version constraint: {clause}")
+            self._clauses.append((_operators[match.group(1) or "=="], version))
+
+    def matches(self, version: Version) -> bool:
+        return all(compare(version.key, other.key) for compare, other in self._clauses)
@@ -0,0 +1,224 @@
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Tuple
+import io
+import mmap
+import os
+import queue
+import secrets
+import stat
+import threading
+
+
+def get_regular_file_descriptor(file: IO) -> Optional[int]:
+    try:
+        fd = file.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+    return fd if stat.S_ISREG(os.fstat(fd).st_mode) else None
+
+
+def remaining_file_size(file: IO) -> Optional[int]:
+    # Size of a regular file's content from its current position
+    fd = get_regular_file_descriptor(file)
+    if fd is None:
+        return None
+    return max(os.fstat(fd).st_size - file.tell(), 0)
+
+
+def preallocate(file: IO, size: Optional[int]) -> bool:
+    # Reserves disk space up front instead of growing the file one chunk at a time
+    if not size or not hasattr(os, "posix_fallocate"):
+        return False
+    fd = get_regular_file_descriptor(file)
+    if fd is None:
+        return False
+    try:
+        file.flush()
+        os.posix_fallocate(fd, file.tell(), size)
+    except OSError:
+        return False
+    return True
+
+
+def truncate_preallocated(file: IO):
+    # Drops any preallocated space beyond what was actually written
+    file.flush()
+    os.ftruncate(file.fileno(), file.tell())
+
+
+class FileView:
+    # Read-only view of a file's content from its current position. Regular files are
+    # memory-mapped so that their content can be sent without copying it into Python
+    # buffers, other files are read into memory.
+    def __init__(self, file: IO) -> None:
+        self._mmap = None
+        fd = get_regular_file_descriptor(file)
+        offset = file.tell() if fd is not None else 0
+        if fd is not None and os.fstat(fd).st_size > offset:
+            self._mmap = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self._mmap)[offset:]
+        else:
+            content = file.read()
+            self.view = memoryview(content.encode("utf-8") if isinstance(content, str) else content)
+
+    def close(self):
+        self.view.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A slice of the view is still in use, the mapping is closed when it's released
+                pass
+            self._mmap = None
+
+
+def _quote_header_param(value: str) -> str:
+    return value.replace("\r", "%0D").replace("\n", "%0A").replace('"', "%22")
+
+
+class MultipartBody:
+    # Streams a multipart/form-data request body. The content of files is passed on as
+    # views, which avoids copying it. Files given as a ChunkPipe are read as their content
+    # is produced, the length of the body is then unknown. on_file_data is called with
+    # each part of the files' content as it is being sent.
+    chunk_size = 1024 * 1024
+
+    def __init__(self, files: Dict[str, Tuple[str, IO]], fields: Dict[str, Any] = None,
+                 on_file_data: Callable[[memoryview], None] = None) -> None:
+        self._boundary = secrets.token_hex(16)
+        self._on_file_data = on_file_data
+        self._file_views: List[FileView] = []
+        self._file_segment_indexes = set()
+        self._segments: List[Any] = []
+        for name, values in ({} if fields is None else fields).items():
+            values = values if isinstance(values, (list, tuple)) else (values,)
+            for value in values:
+                if value is None:
+                    continue
+                self._add_bytes(self._part_header(name) + str(value).encode("utf-8") + b"\r\n")
+        streamed = False
+        for name, (file_name, file) in files.items():
+            self._add_bytes(self._part_header(name, file_name))
+            self._file_segment_indexes.add(len(self._segments))
+            if isinstance(file, ChunkPipe):
+                streamed = True
+                self._segments.append(file)
+            else:
+                file_view = FileView(file)
+                self._file_views.append(file_view)
+                self._segments.append(file_view.view)
+            self._add_bytes(b"\r\n")
+        self._add_bytes(f"--{self._boundary}--\r\n".encode("utf-8"))
+        self._length = None if streamed else sum(len(segment) for segment in self._segments)
+        self._segment_index = 0
+        self._segment_offset = 0
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self._boundary}"
+
+    @property
+    def length(self) -> Optional[int]:
+        return self._length
+
+    def __len__(self) -> int:
+        if self._length is None:
+            raise TypeError("The body contains streamed files and has no known length")
+        return self._length
+
+    def read(self, size: int = -1) -> memoryview:
+        while self._segment_index < len(self._segments):
+            segment = self._segments[self._segment_index]
+            if isinstance(segment, ChunkPipe):
+                chunk = memoryview(segment.read(self.chunk_size if size is None or size < 0 else size))
+                if chunk:
+                    if self._on_file_data is not None:
+                        self._on_file_data(chunk)
+                    return chunk
+            elif self._segment_offset < len(segment):
+                start = self._segment_offset
+                end = len(segment) if size is None or size < 0 else min(len(segment), start + size)
+                self._segment_offset = end
+                chunk = segment[start:end]
+                if self._on_file_data is not None and self._segment_index in self._file_segment_indexes:
+                    self._on_file_data(chunk)
+                return chunk
+            self._segment_index += 1
+            self._segment_offset = 0
+        return memoryview(b"")
+
+    def __iter__(self) -> Iterator[memoryview]:
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self._segments = []
+        for file_view in self._file_views:
+            file_view.close()
+
+    def _add_bytes(self, data: bytes):
+        self._segments.append(memoryview(data))
+
+    def _part_header(self, name: str, file_name: str = None) -> bytes:
+        disposition = f'form-data; name="{_quote_header_param(name)}"'
+        header = f"--{self._boundary}\r\nContent-Disposition: {disposition}"
+        if file_name is not None:
+            header += f'; filename="{_quote_header_param(file_name)}"' \
+                "\r\nContent-Type: application/octet-stream"
+        return (header + "\r\n\r\n").encode("utf-8")
+
+
+class ChunkPipe:
+    # Passes data from a writer thread to a reader thread, e.g. from a download to an archive
+    # extractor. At most max_chunks written chunks are buffered before write() blocks.
+    def __init__(self, max_chunks: int = 8) -> None:
+        self._chunks = queue.Queue(max_chunks)
+        self._current = memoryview(b"")
+        self._eof = False
+        self._writer_error = None
+        self._reader_closed = threading.Event()
+
+    def write(self, data: memoryview) -> int:
+        if self._reader_closed.is_set():
+            raise BrokenPipeError("The reader of the pipe was closed")
+        # The data is copied as writers such as the download loop reuse their buffer
+        self._chunks.put(bytes(data))
+        return len(data)
+
+    def close_writer(self, error: BaseException = None):
+        # With an error, the reader gets it raised instead of seeing the end of the data
+        self._writer_error = error
+        self._chunks.put(None)
+
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        remaining = size
+        while remaining != 0 and not self._eof:
+            if not self._current:
+                chunk = self._chunks.get()
+                if chunk is None:
+                    self._eof = True
+                    if self._writer_error is not None:
+                        raise IOError("The writer of the pipe failed") from self._writer_error
+                    break
+                self._current = memoryview(chunk)
+            part = self._current if remaining < 0 else self._current[:remaining]
+            self._current = self._current[len(part):]
+            parts.append(part)
+            if remaining > 0:
+                remaining -= len(part)
+            # Return what is available rather than waiting for more chunks
+            if size > 0 and self._chunks.empty():
+                break
+        return b"".join(parts)
+
+    def close(self):
+        # Unblocks a writer that is waiting for space, its next write() fails
+        self._reader_closed.set()
+        while True:
+            try:
+                self._chunks.get_nowait()
+            except queue.Empty:
+                break
@@ -0,0 +1,36 @@
+import threading
+import time
+
+
+class TokenBucket:
+    # Limits the number of bytes per second that pass through it. Callers reserve bytes in the
+    # order they arrive and wait until the bucket has refilled enough to cover them, so
+    # transfers that share a bucket get an equal share of the rate. Up to burst bytes can
+    # pass without waiting after the bucket has been idle.
+    def __init__(self, rate: float, burst: float = None) -> None:
+        if rate <= 0:
+            raise Exception("Rate limit must be positive")
+        self.rate = rate
+        self._burst = rate / 10 if burst is None else burst
+        self._tokens = self._burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def chunk_size(self) -> int:
+        # Transfers are split into chunks of about 50 ms, so that they interleave smoothly
+        return int(min(max(self.rate / 20, 4096), 1024 * 1024))
+
+    def reserve(self, amount: int) -> float:
+        # Takes the bytes from the bucket, and returns the number of seconds to wait before
+        # sending or receiving them
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= amount
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def reset_after_fork(self):
+        # The lock may have been held by a thread of the parent that doesn't exist in the child
+        self._lock = threading.Lock()
@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+from typing import Iterator, Optional
+import threading
+import time
+
+
+class RequestTimeoutError(Exception):
+    pass
+
+
+class DeadlineExceededError(RequestTimeoutError):
+    pass
+
+
+# Deadlines apply to all requests made by the thread that set them
+_local = threading.local()
+
+
+def current_deadline() -> Optional[float]:
+    # time.monotonic() value at which the innermost deadline expires
+    return getattr(_local, "expires_at", None)
+
+
+def remaining_time() -> Optional[float]:
+    expires_at = current_deadline()
+    return None if expires_at is None else expires_at - time.monotonic()
+
+
+def check_deadline():
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceededError("Deadline exceeded")
+
+
+@contextmanager
+def deadline(seconds: Optional[float] = None, expires_at: Optional[float] = None) -> Iterator[None]:
+    # All requests made in the block must complete within the given number of seconds, or
+    # before the given time.monotonic() value. A nested deadline can only shorten an outer one.
+    if seconds is not None:
+        seconds_expire_at = time.monotonic() + seconds
+        expires_at = seconds_expire_at if expires_at is None else min(expires_at, seconds_expire_at)
+    outer = current_deadline()
+    if expires_at is None or (outer is not None and outer <= expires_at):
+        yield
+        return
+    _local.expires_at = expires_at
+    try:
+        yield
+    finally:
+        _local.expires_at = outer
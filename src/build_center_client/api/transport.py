@@ -0,0 +1,256 @@
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import socket
+import threading
+
+from . import profiling
+from .compression import available_encodings
+from .timeouts import RequestTimeoutError
+
+logger = logging.getLogger("buildcenter.common.http")
+
+# Connect and read timeouts in seconds, None means no timeout
+Timeout = Tuple[Optional[float], Optional[float]]
+
+
+class Transport:
+    # Sends a single HTTP request and returns a response object with the status_code,
+    # headers, content and text of requests.Response, and close(). The body is given
+    # encoded as data, bytes or an iterable of them. Streamed response bodies are read
+    # through readinto(). Timeouts are raised as RequestTimeoutError.
+    def request(self, method: str, url: str, headers: Dict[str, str], data: Any = None,
+                proxies: Dict[str, str] = None, stream: bool = False,
+                timeout: Timeout = None) -> Any:
+        raise Exception("Not implemented yet")
+
+    def accept_encodings(self) -> List[str]:
+        # Response content encodings that the transport can decode, ordered by preference
+        return ["gzip", "deflate"]
+
+    def bytes_received(self, response: Any) -> int:
+        # Size of the response body as received, before decoding the content encoding
+        return len(response.content)
+
+    def readinto(self, response: Any, buffer: memoryview) -> int:
+        # Reads the next part of a streamed response body into the buffer
+        return response.readinto(buffer)
+
+    def close(self):
+        pass
+
+    def reset(self):
+        # Called in a forked child process. Connections inherited from the parent must
+        # not be used, since both processes would read from and write to the same sockets.
+        pass
+
+
+class RequestsTransport(Transport):
+    # Safe for concurrent use. Up to pool_size connections per host are kept alive,
+    # which should be at least the number of threads that share the transport.
+    def __init__(self, pool_size: int = None) -> None:
+        self._pool_size = pool_size
+        self._session = self._create_session()
+
+    def _create_session(self):
+        with profiling.phase("import"):
+            import requests
+        # A session keeps connections alive between requests
+        session = requests.Session()
+        if self._pool_size is not None:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=self._pool_size, pool_maxsize=self._pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        return session
+
+    def request(self, method: str, url: str, headers: Dict[str, str], data: Any = None,
+                proxies: Dict[str, str] = None, stream: bool = False,
+                timeout: Timeout = None) -> Any:
+        import requests
+        from urllib3.exceptions import ReadTimeoutError
+        try:
+            return self._session.request(method, url, headers=headers, data=data,
+                                         proxies=proxies, stream=stream, timeout=timeout)
+        except requests.exceptions.Timeout as e:
+            raise RequestTimeoutError(f"Request timed out: {e}") from e
+        except requests.exceptions.ConnectionError as e:
+            # Timeouts while reading the response body are reported as connection errors
+            if e.args and isinstance(e.args[0], ReadTimeoutError):
+                raise RequestTimeoutError(f"Request timed out: {e}") from e
+            raise
+
+    def accept_encodings(self) -> List[str]:
+        from urllib3.util.request import ACCEPT_ENCODING
+        supported = [e.strip() for e in ACCEPT_ENCODING.split(",")]
+        return [e for e in available_encodings() if e in supported]
+
+    def bytes_received(self, response: Any) -> int:
+        # urllib3 counts the bytes read from the socket
+        return response.raw.tell()
+
+    def readinto(self, response: Any, buffer: memoryview) -> int:
+        from urllib3.exceptions import ReadTimeoutError
+        raw = response.raw
+        try:
+            if response.headers.get("Content-Encoding", "identity") == "identity" and raw._fp is not None:
+                # Straight into the buffer, the readinto() of urllib3 reads into new bytes and copies them
+                return raw._fp.readinto(buffer)
+            # urllib3 1.26 can return more than asked for once decoded, the rest is kept for the next call
+            data = getattr(response, "_decoded_rest", b"") or raw.read(len(buffer), decode_content=True)
+            response._decoded_rest = data[len(buffer):]
+            length = min(len(data), len(buffer))
+            buffer[:length] = data[:length]
+            return length
+        except (ReadTimeoutError, socket.timeout) as e:
+            raise RequestTimeoutError(f"Request timed out: {e}") from e
+
+    def close(self):
+        self._session.close()
+
+    def reset(self):
+        # The old session isn't closed as that could affect the parent's connections
+        self._session = self._create_session()
+
+
+class Http2Response:
+    def __init__(self, response, httpx) -> None:
+        self._response = response
+        self._httpx = httpx
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self._chunks = None
+
+    @property
+    def content(self) -> bytes:
+        return self._response.read()
+
+    @property
+    def text(self) -> str:
+        self._response.read()
+        return self._response.text
+
+    @property
+    def num_bytes_downloaded(self) -> int:
+        return self._response.num_bytes_downloaded
+
+    def readinto(self, buffer: memoryview) -> int:
+        if self._chunks is None:
+            self._chunks = self._response.iter_bytes(len(buffer))
+        try:
+            chunk = next(self._chunks, b"")
+        except self._httpx.TimeoutException as e:
+            raise RequestTimeoutError(f"Request timed out: {e}") from e
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+    def close(self):
+        self._response.close()
+
+
+class Http2Transport(Transport):
+    # Multiplexes concurrent requests over a single connection per host.
+    # Requires the optional "httpx[http2]" dependency. HTTP/2 is negotiated for https://
+    # URLs, http:// URLs are sent as HTTP/2 right away (h2c with prior knowledge), which the
+    # server must support.
+    def __init__(self) -> None:
+        try:
+            with profiling.phase("import"):
+                import httpx
+        except ImportError:
+            raise Exception(
+                "HTTP/2 support requires httpx, install build_center_client[http2]")
+        self._httpx = httpx
+        self._lock = threading.Lock()
+        self._client = None
+        self._client_proxies = None
+        self._open_lock = threading.Lock()
+        self._connected = False
+        self._warned = False
+
+    def request(self, method: str, url: str, headers: Dict[str, str], data: Any = None,
+                proxies: Dict[str, str] = None, stream: bool = False,
+                timeout: Timeout = None) -> Any:
+        client = self._get_client(proxies)
+        # httpx expects raw bodies through "content" rather than "data"
+        content = None
+        if data is not None and not isinstance(data, dict):
+            content, data = data, None
+        connect_timeout, read_timeout = (None, None) if timeout is None else timeout
+        # httpcore picks the stream ID of a request before sending its headers, without a lock,
+        # so concurrent threads could send their streams out of order, which servers reject.
+        # Requests are opened one at a time, until their headers are sent.
+        opened = []
+
+        def open_stream(name: str, info: dict):
+            if name.endswith("send_request_headers.complete") and not opened:
+                opened.append(True)
+                self._open_lock.release()
+
+        request = client.build_request(
+            method, url, headers=headers, data=data, content=content,
+            timeout=self._httpx.Timeout(connect=connect_timeout, read=read_timeout,
+                                        write=read_timeout, pool=connect_timeout),
+            extensions={"trace": open_stream})
+        self._open_lock.acquire()
+        try:
+            response = client.send(request, stream=stream)
+        except self._httpx.TimeoutException as e:
+            raise RequestTimeoutError(f"Request timed out: {e}") from e
+        except self._httpx.RemoteProtocolError as e:
+            if request.url.scheme == "http" and proxies is None and not self._connected:
+                raise Exception(f"HTTP/2 request failed, the server may not accept HTTP/2 without TLS: {e}") from e
+            raise
+        finally:
+            if not opened:
+                opened.append(True)
+                self._open_lock.release()
+        self._connected = True
+        if response.http_version != "HTTP/2" and not self._warned:
+            # E.g. servers that don't offer HTTP/2 over TLS, or requests through a proxy
+            self._warned = True
+            logger.warning("HTTP/2 was requested but the server at %s uses %s, requests aren't multiplexed",
+                           request.url.host, response.http_version)
+        return Http2Response(response, self._httpx)
+
+    def accept_encodings(self) -> List[str]:
+        # httpx decodes zstd only from 0.27.1, even when zstandard is installed
+        try:
+            from httpx._decoders import SUPPORTED_DECODERS as supported
+        except ImportError:
+            supported = ("gzip", "deflate")
+        return [e for e in available_encodings() if e in supported]
+
+    def bytes_received(self, response: Any) -> int:
+        return response.num_bytes_downloaded
+
+    def close(self):
+        with self._lock:
+            self._close_client()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self._client_proxies = None
+        self._open_lock = threading.Lock()
+        self._connected = False
+        self._warned = False
+
+    def _close_client(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def _get_client(self, proxies: Dict[str, str] = None):
+        # httpx clients are safe for concurrent use, only their creation is synchronized
+        with self._lock:
+            if self._client is None or proxies != self._client_proxies:
+                self._close_client()
+                if proxies is None:
+                    # Without TLS there is no protocol negotiation, httpx would fall back to HTTP/1.1
+                    mounts = {"http://": self._httpx.HTTPTransport(http1=False, http2=True)}
+                else:
+                    mounts = {f"{scheme}://": self._httpx.HTTPTransport(http2=True, proxy=proxy)
+                              for scheme, proxy in proxies.items()}
+                self._client = self._httpx.Client(http2=True, mounts=mounts)
+                self._client_proxies = proxies
+            return self._client
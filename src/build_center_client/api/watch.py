@@ -0,0 +1,115 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional
+import hashlib
+import logging
+import os
+import threading
+
+from . import json_backend
+from .base_endpoints import ListResourceEndpoint
+
+
+logger = logging.getLogger("buildcenter.watch")
+
+
+class WatchEventType(Enum):
+    CREATED = "created"
+    CHANGED = "changed"
+    REMOVED = "removed"
+
+
+@dataclass
+class WatchEvent:
+    type: WatchEventType
+    resource: Any = None
+    id: Optional[str] = None
+
+
+@dataclass
+class WatchState:
+    # Fingerprint of each known resource by ID
+    known: Dict[str, str] = None
+    # ETag/Last-Modified of the last response, for conditional requests
+    validators: Dict[str, str] = None
+
+    @staticmethod
+    def load(path: str) -> "WatchState":
+        if path is None or not os.path.exists(path):
+            return WatchState()
+        with open(path, "rb") as f:
+            data = json_backend.load(f)
+        # State files of older versions also have a "created_at", which isn't used
+        return WatchState(known=data.get("known"), validators=data.get("validators"))
+
+    def save(self, path: str):
+        if path is None:
+            return
+        # Replace the file atomically so that an interrupted write doesn't lose the state
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(json_backend.dumps(dict(known=self.known, validators=self.validators)))
+        os.replace(temp_path, path)
+
+
+class Watcher:
+    # Polls a list endpoint and reports resources that were created, changed or removed
+    # since the last poll. The poll interval grows while nothing changes, and is reset
+    # to the minimum after a change.
+    def __init__(self, endpoint: ListResourceEndpoint, state_path: str = None,
+                 min_interval: float = 5, max_interval: float = 300, backoff: float = 2,
+                 emit_existing: bool = False) -> None:
+        self._endpoint = endpoint
+        self._state_path = state_path
+        self._state = WatchState.load(state_path)
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._backoff = backoff
+        self._emit_existing = emit_existing
+        self.interval = min_interval
+
+    def poll(self) -> List[WatchEvent]:
+        # The new state only replaces the current one once it is saved, so that the events
+        # are reported again on the next poll if saving fails
+        state = self._state
+        resources, validators = self._endpoint.list_if_changed(state.validators)
+        if resources is None:
+            return []
+        # Without a previous state, existing resources are only reported if requested
+        is_first_poll = state.known is None
+        known = {} if state.known is None else state.known
+        new_state = WatchState(known={}, validators=validators)
+        events = []
+        for resource in resources:
+            fingerprint = hashlib.sha1(resource.raw().encode("utf-8")).hexdigest()
+            new_state.known[resource.id] = fingerprint
+            previous = known.get(resource.id)
+            if previous is None:
+                if not is_first_poll or self._emit_existing:
+                    events.append(WatchEvent(WatchEventType.CREATED, resource, resource.id))
+            elif previous != fingerprint:
+                events.append(WatchEvent(WatchEventType.CHANGED, resource, resource.id))
+        for id in known.keys() - new_state.known.keys():
+            events.append(WatchEvent(WatchEventType.REMOVED, id=id))
+        new_state.save(self._state_path)
+        self._state = new_state
+        return events
+
+    def run(self, on_event: Callable[[WatchEvent], None], stop: threading.Event = None,
+            once: bool = False):
+        stop = threading.Event() if stop is None else stop
+        while not stop.is_set():
+            try:
+                events = self.poll()
+            except Exception as e:
+                if once:
+                    raise
+                logger.warning("Poll failed: %s", e)
+                events = []
+            for event in events:
+                on_event(event)
+            if once:
+                return
+            self.interval = self._min_interval if events else \
+                min(self.interval * self._backoff, self._max_interval)
+            stop.wait(self.interval)
@@ -3,8 +3,6 @@ import os
 import sys
 from typing import IO, Any
 
-from build_center_client.api.api import WebhookEvent, WebhookType
-
 
 class FileArg:
     def __init__(self, io: IO, path: str = None) -> None:
@@ -24,8 +22,10 @@ class FileArg:
 class FileInputAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None) -> Any:
         # TODO: close file
-        values = FileArg(
-            sys.stdin) if values == "-" or values is None else FileArg(open(values, "rb"), values)
+        # An omitted optional positional passes its default through here
+        if not isinstance(values, FileArg):
+            values = FileArg(
+                sys.stdin) if values == "-" or values is None else FileArg(open(values, "rb"), values)
         setattr(namespace, self.dest, values)
 
 
@@ -39,12 +39,14 @@ class FileOutputAction(argparse.Action):
 
 class WebhookTypeAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None) -> Any:
+        from build_center_client.api.api import WebhookType
         values = WebhookType(values)
         setattr(namespace, self.dest, values)
 
 
 class WebhookEventsAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None) -> Any:
+        from build_center_client.api.api import WebhookEvent
         values = tuple(WebhookEvent(v) for v in values.split(","))
         setattr(namespace, self.dest, values)
 
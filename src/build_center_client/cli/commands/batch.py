@@ -0,0 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import sys
+import threading
+from typing import Any, Dict
+
+from build_center_client.api import json_backend
+from build_center_client.api.encoding import ApiJsonEncoder
+from build_center_client.api.timeouts import current_deadline, deadline
+from .actions import FileArg
+from .factory import create_api
+from .parser import find_sub_command, setup_root_parser
+
+
+batch_sub_commands = ("apps", "releases", "assets", "tokens", "webhooks")
+
+
+class _BatchStdio(FileArg):
+    # Stands in for the stdin and stdout defaults, which carry the batch's own commands and results
+    def __init__(self, dest: str) -> None:
+        super().__init__(None)
+        self._dest = dest
+
+    def io(self):
+        raise Exception(f"In batch mode, {self._dest} must name a file, stdin and stdout carry the batch")
+
+
+def is_help_arg(arg: str) -> bool:
+    # Also abbreviations of --help, which argparse accepts
+    return arg == "-h" or len(arg) >= 3 and "--help".startswith(arg)
+
+
+def parse_batch_line(line: str, index: int):
+    command = json_backend.loads(line)
+    # A line is either a list of CLI arguments or an object with "args" and an optional "id"
+    if isinstance(command, dict):
+        return command.get("id", index), command["args"]
+    return index, command
+
+
+def run_batch_command(api, index: int, line: str, expires_at: float = None) -> Dict[str, Any]:
+    results = []
+    id = index
+    try:
+        id, args = parse_batch_line(line, index)
+        parser = setup_root_parser(args)
+        sub_command = find_sub_command(parser, args)
+        if sub_command not in batch_sub_commands:
+            raise Exception(f"Unsupported command in batch mode: {sub_command}")
+        # Help is printed to stdout, where it would be mixed up with the results
+        options = args[:args.index("--")] if "--" in args else args
+        if any(is_help_arg(arg) for arg in options):
+            raise Exception("Help isn't available in batch mode")
+        try:
+            parsed_args = parser.parse_args(args)
+        except SystemExit:
+            raise Exception("Invalid arguments")
+        if getattr(parsed_args.func, "prints_help", False):
+            raise Exception(f"Incomplete command: {' '.join(args)}")
+        command_args = {name: _BatchStdio(name) if isinstance(value, FileArg) and value.path() is None else value
+                        for name, value in vars(parsed_args).items()}
+        # Profiling covers the whole batch, so it can't be enabled per command
+        command_args.pop("profile", None)
+        command_args.pop("profile_out", None)
+        try:
+            # Each command is bounded by its own --deadline and by the deadline of the batch
+            with deadline(command_args.pop("deadline", None), expires_at=expires_at):
+                parsed_args.func(**command_args, api=api,
+                                 emit=lambda data, fields=None, ndjson=False: results.append(
+                                     ApiJsonEncoder.encode(data, level=1, fields=fields)))
+        finally:
+            for value in vars(parsed_args).values():
+                if isinstance(value, FileArg) and value.path() is not None:
+                    value.io().close()
+    except Exception as e:
+        return {"id": id, "ok": False, "error": str(e)}
+    result = None if len(results) == 0 else results[0] if len(results) == 1 else results
+    return {"id": id, "ok": True, "result": result}
+
+
+def cmd_batch(infile: FileArg, workers: int, server: str, token: str, proxy: str = None,
+              http2: bool = False, **kwargs):
+    # Each worker can keep its own connection alive. The client options such as timeouts and
+    # rate limits are in kwargs, and the rate limits are shared by all workers.
+    api = create_api(server, token, proxy=proxy, http2=http2, pool_size=max(workers, 1), **kwargs)
+    # Deadlines are per thread, so the deadline of the batch is passed on to the workers
+    expires_at = current_deadline()
+    lines = (line for line in infile.io() if line.strip())
+    # Results are written in the same order as the commands, each as soon as it and the ones
+    # before it are done, so that a driver can wait for the result of a command before
+    # sending the next one. At most this many commands are submitted ahead of the writer.
+    pending = queue.Queue(max(workers, 1) * 2)
+    failed = []
+    write_errors = []
+
+    def write_results():
+        while True:
+            future = pending.get()
+            if future is None:
+                return
+            if write_errors:
+                # Results can't be written anymore, the commands that haven't started are dropped.
+                # Futures are still taken from the queue, so that submitting doesn't block.
+                future.cancel()
+                continue
+            try:
+                result = future.result()
+                if not result["ok"]:
+                    failed.append(result["id"])
+                sys.stdout.write(json_backend.dumps(result) + "\n")
+                sys.stdout.flush()
+            except BaseException as e:
+                write_errors.append(e)
+
+    writer = threading.Thread(target=write_results, name="batch-writer")
+    writer.start()
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            for index, line in enumerate(lines):
+                if write_errors:
+                    break
+                pending.put(executor.submit(run_batch_command, api, index, line, expires_at=expires_at))
+    finally:
+        pending.put(None)
+        writer.join()
+    if write_errors:
+        if isinstance(write_errors[0], BrokenPipeError):
+            # The reader has gone away, e.g. head. Python would fail again flushing stdout on exit.
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(1)
+        raise write_errors[0]
+    if failed:
+        sys.exit(1)
@@ -1,31 +1,42 @@
-from typing import IO, Dict, Generic, Iterable, List, Sequence, TypeVar
+from typing import IO, Any, Callable, Dict, Generic, Iterable, List, Sequence, TypeVar
+import os
 import humps
-import json
 
 from build_center_client.api.api import AccessFlags, AccessTokenEndpoint, Api, AppEndpoint, \
     AssetEndpoint, ReleaseEndpoint, WebhookEndpoint, WebhookEvent, WebhookType
+from build_center_client.api import json_backend
 from build_center_client.api.encoding import ApiJsonEncoder
 from .actions import FileArg
+from .progress import ProgressPrinter
 
 
 TEndpoint = TypeVar("TEndpoint")
 
 
+def print_json(data: Any, fields: List[str] = None, ndjson: bool = False):
+    if ndjson:
+        print(ApiJsonEncoder.encode_line(data, fields), flush=True)
+    else:
+        print(ApiJsonEncoder.encode(data, fields=fields))
+
+
 class CommandsBase(Generic[TEndpoint]):
-    def __init__(self, api: Api):
+    def __init__(self, api: Api, emit: Callable[..., None] = None):
         self._api = api
+        # Receives the result of a command, printed as JSON unless overridden
+        self._emit = print_json if emit is None else emit
 
     def create(self, **kwargs):
         endpoint = self._get_endpoint()
-        print(ApiJsonEncoder.encode(endpoint.create(**kwargs)))
+        self._emit(endpoint.create(**kwargs))
 
-    def list(self, **kwargs):
+    def list(self, output: str = "json", fields: List[str] = None, **kwargs):
         endpoint = self._get_endpoint()
-        print(ApiJsonEncoder.encode(endpoint.list()))
+        self._emit_list(endpoint.iter(), output, fields)
 
     def get(self, id: str, **kwargs):
         endpoint = self._get_endpoint()
-        print(ApiJsonEncoder.encode(endpoint.get(id)))
+        self._emit(endpoint.get(id))
 
     def remove(self, id: str, **kwargs):
         endpoint = self._get_endpoint()
@@ -36,13 +47,21 @@ class CommandsBase(Generic[TEndpoint]):
 
     def update_from_io(self, io: IO):
         endpoint = self._get_endpoint()
-        res = humps.decamelize(json.load(io))
+        res = humps.decamelize(json_backend.load(io))
         if isinstance(res, Sequence):
             sequence = tuple(
                 map(lambda res_item: endpoint.update(**res_item), res))
-            print(ApiJsonEncoder.encode(sequence))
+            self._emit(sequence)
         else:
-            print(ApiJsonEncoder.encode(endpoint.update(**res)))
+            self._emit(endpoint.update(**res))
+
+    def _emit_list(self, resources: Iterable[Any], output: str = "json", fields: List[str] = None):
+        if output == "ndjson":
+            # Each resource is written as soon as it has been decoded
+            for resource in resources:
+                self._emit(resource, fields=fields, ndjson=True)
+        else:
+            self._emit(tuple(resources), fields=fields)
 
     def _get_endpoint(self) -> TEndpoint:
         return self._get_endpoint_impl(self._api)
@@ -52,8 +71,8 @@ class CommandsBase(Generic[TEndpoint]):
 
 
 class AppCommands(CommandsBase[AppEndpoint]):
-    def __init__(self, api: Api):
-        super().__init__(api)
+    def __init__(self, api: Api, emit: Callable[..., None] = None):
+        super().__init__(api, emit)
 
     def create(self, name: str, title: str, description: str = None, public: bool = False):
         return super().create(name=name, title=title, description=description, public=public)
@@ -63,50 +82,87 @@ class AppCommands(CommandsBase[AppEndpoint]):
 
 
 class ReleaseCommands(CommandsBase[ReleaseEndpoint]):
-    def __init__(self, api: Api):
-        super().__init__(api)
+    def __init__(self, api: Api, emit: Callable[..., None] = None):
+        super().__init__(api, emit)
 
     def create(self, app: str, version: str, title: str = None, description: str = None,
                commit: str = None):
         app_ = self._api.apps.get(app)
-        print(ApiJsonEncoder.encode(app_.releases().create(
+        self._emit(app_.releases().create(
             version=version, title=title, description=description,
-            commit=commit, app_id=app_.id)))
+            commit=commit, app_id=app_.id))
+
+    def list(self, app: str, output: str = "json", fields: List[str] = None):
+        app_ = self._api.apps.get(app)
+        self._emit_list(app_.releases().iter(), output, fields)
 
-    def list(self, app: str):
+    def latest(self, app: str, constraint: str = None, prerelease: bool = False,
+               include_unpublished: bool = False, refresh: bool = False):
         app_ = self._api.apps.get(app)
-        print(ApiJsonEncoder.encode(app_.releases().list()))
+        release = app_.releases().resolve(constraint, prerelease=prerelease,
+                                          published=None if include_unpublished else True,
+                                          refresh=refresh)
+        if release is None:
+            raise Exception("No matching release")
+        self._emit(release)
 
     def _get_endpoint_impl(self, api) -> any:
         return api.releases
 
 
 class AssetCommands(CommandsBase[AssetEndpoint]):
-    def __init__(self, api: Api):
-        super().__init__(api)
+    def __init__(self, api: Api, emit: Callable[..., None] = None):
+        super().__init__(api, emit)
 
-    def create(self, release: str, file: FileArg, name: str = None, tag: Dict[str, str] = None):
+    def create(self, release: str, file: FileArg, name: str = None, tag: Dict[str, str] = None,
+               verify: bool = False, progress: bool = False, dir: str = None, format: str = None):
         release_ = self._api.releases.get(release)
-        print(ApiJsonEncoder.encode(release_.assets().create_with_file(
-            name=file.basename() if name is None else name, file=file.io(),
-            tags=tag)))
-
-    def list(self, release: str):
+        if dir is not None:
+            if file.path() is not None:
+                raise Exception("Either a file or --dir can be uploaded, not both")
+            format = "tar.gz" if format is None and name is None else format
+            if name is None:
+                name = os.path.basename(os.path.normpath(os.path.abspath(dir))) + "." + format.lstrip(".")
+            self._emit(release_.assets().create_from_directory(
+                name, dir, format=format, tags=tag, verify=verify,
+                on_progress=ProgressPrinter(f"Uploading {name}") if progress else None))
+            return
+        name = file.basename() if name is None else name
+        self._emit(release_.assets().create_with_file(
+            name=name, file=file.io(), tags=tag, verify=verify,
+            on_progress=ProgressPrinter(f"Uploading {name}") if progress else None))
+
+    def list(self, release: str, output: str = "json", fields: List[str] = None):
         release_ = self._api.releases.get(release)
-        print(ApiJsonEncoder.encode(release_.assets().list()))
+        self._emit_list(release_.assets().iter(), output, fields)
 
-    def download(self, id: str, out: FileArg):
+    def find(self, tag: Dict[str, str], release: str = None, app: str = None, refresh: bool = False,
+             output: str = "json", fields: List[str] = None):
+        if release is not None:
+            releases = (self._api.releases.get(release),)
+        else:
+            releases = self._api.apps.get(app).releases().iter()
+        assets = (asset for release_ in releases
+                  for asset in release_.assets().find(tag, refresh=refresh))
+        self._emit_list(assets, output, fields)
+
+    def download(self, id: str, out: FileArg, progress: bool = False, extract: str = None,
+                 format: str = None):
         endpoint = self._get_endpoint()
         asset = endpoint.get(id)
-        asset.download(out.io())
+        on_progress = ProgressPrinter(f"Downloading {asset.name}") if progress else None
+        if extract is not None:
+            asset.extract_to(extract, format=format, on_progress=on_progress)
+        else:
+            asset.download(out.io(), on_progress=on_progress)
 
     def _get_endpoint_impl(self, api) -> any:
         return api.assets
 
 
 class AccessTokenCommands(CommandsBase[AccessTokenEndpoint]):
-    def __init__(self, api: Api):
-        super().__init__(api)
+    def __init__(self, api: Api, emit: Callable[..., None] = None):
+        super().__init__(api, emit)
 
     def create(self, app: str, access: AccessFlags,
                description: str = None, validity_duration: int = None,
@@ -120,32 +176,32 @@ class AccessTokenCommands(CommandsBase[AccessTokenEndpoint]):
             token = app_.tokens().create(description=description, access=access,
                                          validity_duration=validity_duration,
                                          enabled=enabled)
-        print(ApiJsonEncoder.encode(token))
+        self._emit(token)
 
-    def list(self, app: str = None):
+    def list(self, app: str = None, output: str = "json", fields: List[str] = None):
         if app is None:
-            tokens = self._api.access_tokens.list()
+            tokens = self._api.access_tokens.iter()
         else:
             app_ = self._api.apps.get(app)
-            tokens = app_.tokens().list()
-        print(ApiJsonEncoder.encode(tokens))
+            tokens = app_.tokens().iter()
+        self._emit_list(tokens, output, fields)
 
     def _get_endpoint_impl(self, api) -> any:
         return api.access_tokens
 
 
 class WebhookCommands(CommandsBase[WebhookEndpoint]):
-    def __init__(self, api: Api):
-        super().__init__(api)
+    def __init__(self, api: Api, emit: Callable[..., None] = None):
+        super().__init__(api, emit)
 
     def create(self, app: str, type: WebhookType, url: str, events: List[WebhookEvent]):
         app_ = self._api.apps.get(app)
-        print(ApiJsonEncoder.encode(app_.webhooks().create(
-            type=type, url=url, events=events)))
+        self._emit(app_.webhooks().create(
+            type=type, url=url, events=events))
 
-    def list(self, app: str):
+    def list(self, app: str, output: str = "json", fields: List[str] = None):
         app_ = self._api.apps.get(app)
-        print(ApiJsonEncoder.encode(app_.webhooks().list()))
+        self._emit_list(app_.webhooks().iter(), output, fields)
 
     def _get_endpoint_impl(self, api) -> any:
         return api.webhooks
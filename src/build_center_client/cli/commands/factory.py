@@ -1,16 +1,51 @@
-from build_center_client.api.api import Api
-from build_center_client.api.http import ApiHttpClient
+import importlib
 
 
-def create_api(server: str, token: str, proxy: str = None, **kwargs):
-    return Api(ApiHttpClient(server, token=token, proxy_address=proxy))
+# Root options that configure the API client rather than the command
+client_options = ("connect_timeout", "read_timeout", "limit_rate", "limit_upload_rate",
+                  "limit_download_rate")
 
 
-def call_cmd_factory(type_, method: str, server: str, token: str, proxy: str, **kwargs):
-    return getattr(type_(create_api(server, token, proxy=proxy)), method)(**kwargs)
+def create_api(server: str, token: str, proxy: str = None, http2: bool = False,
+               pool_size: int = None, connect_timeout: float = None, read_timeout: float = None,
+               limit_rate: float = None, limit_upload_rate: float = None,
+               limit_download_rate: float = None, **kwargs):
+    # Imported here to keep CLI startup fast for commands that don't use the API
+    from build_center_client.api import profiling
+    with profiling.phase("import"):
+        from build_center_client.api.api import Api
+        from build_center_client.api.http import ApiHttpClient
+    upload_rate_limit = limit_rate if limit_upload_rate is None else limit_upload_rate
+    download_rate_limit = limit_rate if limit_download_rate is None else limit_download_rate
+    return Api(ApiHttpClient(server, token=token, proxy_address=proxy, http2=http2,
+                             pool_size=pool_size, connect_timeout=connect_timeout,
+                             read_timeout=read_timeout, upload_rate_limit=upload_rate_limit,
+                             download_rate_limit=download_rate_limit))
 
 
-def create_cmd_factory(type_, method: str):
+def call_cmd_factory(type_name: str, method: str, server: str, token: str, proxy: str, http2: bool,
+                     api=None, emit=None, **kwargs):
+    from build_center_client.api import profiling
+    with profiling.phase("import"):
+        type_ = getattr(importlib.import_module(".commands", __package__), type_name)
+    options = {name: kwargs.pop(name) for name in client_options if name in kwargs}
+    # An existing API object can be passed in to share its connections between commands
+    if api is None:
+        api = create_api(server, token, proxy=proxy, http2=http2, **options)
+    return getattr(type_(api, emit=emit), method)(**kwargs)
+
+
+def create_cmd_factory(type_name: str, method: str):
     # Here we can strip away parameters that we don't want passed down, such as "func" that comes from argparse
-    return lambda server, token, proxy, log, func, **kwargs: \
-        call_cmd_factory(type_, method, server, token, proxy, **kwargs)
+    return lambda server, token, proxy, http2, log, func, **kwargs: \
+        call_cmd_factory(type_name, method, server, token, proxy, http2, **kwargs)
+
+
+def create_lazy_cmd(module_name: str, function_name: str):
+    # The module is only imported when the command runs
+    def cmd(**kwargs):
+        from build_center_client.api import profiling
+        with profiling.phase("import"):
+            module = importlib.import_module(module_name, __package__)
+        return getattr(module, function_name)(**kwargs)
+    return cmd
@@ -1,22 +1,58 @@
 import sys
 import os
 import argparse
+from typing import List, Optional
 
 from .actions import FileArg, FileInputAction, FileOutputAction, \
     StoreKeyValueAction, WebhookEventsAction, WebhookTypeAction
-from .commands import AccessTokenCommands, AppCommands, AssetCommands, \
-    ReleaseCommands, WebhookCommands
-from .factory import create_cmd_factory
-from .setup import cmd_setup
-from .test import cmd_test
+from .factory import create_cmd_factory, create_lazy_cmd
 
 
 local_server_url = "http://localhost:5000"
+archive_formats = ("tar", "tar.gz", "tgz", "tar.bz2", "tar.xz", "tar.zst", "tzst", "zip")
+# Shared by the full sub-command parsers and the ones that are only registered by name
+sub_command_help = {
+    "batch": "run newline-delimited JSON commands over a shared connection",
+    "watch": "print new, changed and removed resources as NDJSON events",
+}
+
+
+def print_help_cmd(parser):
+    # Default of commands that need a sub-command, which only print their help
+    def print_help(**kwargs):
+        parser.print_help()
+    print_help.prints_help = True
+    return print_help
+
+
+def parse_fields(value: str) -> List[str]:
+    return [field.strip() for field in value.split(",") if field.strip()]
+
+
+def parse_rate(value: str) -> float:
+    # Bytes per second with an optional binary suffix, e.g. 500K or 20M
+    multipliers = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    value = value.strip().upper()
+    multiplier = multipliers.get(value[-1:], 1)
+    try:
+        rate = float(value[:-1] if value[-1:] in multipliers else value) * multiplier
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid rate: {value}")
+    if rate <= 0:
+        raise argparse.ArgumentTypeError(f"rate must be positive: {value}")
+    return rate
+
+
+def add_list_output_arguments(list_parser):
+    list_parser.add_argument("--output", choices=("json", "ndjson"), default="json",
+                             help="print one JSON array, or one JSON object per line as it arrives")
+    list_parser.add_argument("--fields", type=parse_fields,
+                             help="comma-separated fields to include, e.g. id,version,created_at")
 
 
 def setup_apps_parser(root_subparsers):
     parser = root_subparsers.add_parser("apps")
-    parser.set_defaults(func=lambda **kwargs: parser.print_help())
+    parser.set_defaults(func=print_help_cmd(parser))
     subparsers = parser.add_subparsers(help="sub-commands")
 
     create_parser = subparsers.add_parser("create")
@@ -24,28 +60,29 @@ def setup_apps_parser(root_subparsers):
     create_parser.add_argument("--title", required=True)
     create_parser.add_argument("--description")
     create_parser.add_argument("--public", action="store_true")
-    create_parser.set_defaults(func=create_cmd_factory(AppCommands, "create"))
+    create_parser.set_defaults(func=create_cmd_factory("AppCommands", "create"))
 
     list_parser = subparsers.add_parser("ls")
-    list_parser.set_defaults(func=create_cmd_factory(AppCommands, "list"))
+    add_list_output_arguments(list_parser)
+    list_parser.set_defaults(func=create_cmd_factory("AppCommands", "list"))
 
     get_parser = subparsers.add_parser("get")
     get_parser.add_argument("id")
-    get_parser.set_defaults(func=create_cmd_factory(AppCommands, "get"))
+    get_parser.set_defaults(func=create_cmd_factory("AppCommands", "get"))
 
     update_parser = subparsers.add_parser("update")
     update_parser.add_argument(
         "--infile", action=FileInputAction, default=FileArg(sys.stdin.buffer))
-    update_parser.set_defaults(func=create_cmd_factory(AppCommands, "update"))
+    update_parser.set_defaults(func=create_cmd_factory("AppCommands", "update"))
 
     remove_parser = subparsers.add_parser("rm")
     remove_parser.add_argument("id")
-    remove_parser.set_defaults(func=create_cmd_factory(AppCommands, "remove"))
+    remove_parser.set_defaults(func=create_cmd_factory("AppCommands", "remove"))
 
 
 def setup_releases_parser(root_subparsers):
     parser = root_subparsers.add_parser("releases")
-    parser.set_defaults(func=lambda **kwargs: parser.print_help())
+    parser.set_defaults(func=print_help_cmd(parser))
     subparsers = parser.add_subparsers(help="sub-commands")
 
     create_parser = subparsers.add_parser("create")
@@ -55,69 +92,108 @@ def setup_releases_parser(root_subparsers):
     create_parser.add_argument("--description")
     create_parser.add_argument("--commit")
     create_parser.set_defaults(
-        func=create_cmd_factory(ReleaseCommands, "create"))
+        func=create_cmd_factory("ReleaseCommands", "create"))
 
     list_parser = subparsers.add_parser("ls")
     list_parser.add_argument("--app", help="app identifier", required=True)
-    list_parser.set_defaults(func=create_cmd_factory(ReleaseCommands, "list"))
+    add_list_output_arguments(list_parser)
+    list_parser.set_defaults(func=create_cmd_factory("ReleaseCommands", "list"))
+
+    latest_parser = subparsers.add_parser("latest")
+    latest_parser.add_argument("--app", help="app identifier", required=True)
+    latest_parser.add_argument("--constraint", help="version constraint, e.g. '>=1.2,<2'")
+    latest_parser.add_argument("--prerelease", help="include pre-releases", action="store_true")
+    latest_parser.add_argument("--include-unpublished", help="include unpublished releases",
+                               action="store_true")
+    latest_parser.add_argument("--refresh", help="re-list releases that are already indexed",
+                               action="store_true")
+    latest_parser.set_defaults(func=create_cmd_factory("ReleaseCommands", "latest"))
 
     get_parser = subparsers.add_parser("get")
     get_parser.add_argument("id")
-    get_parser.set_defaults(func=create_cmd_factory(ReleaseCommands, "get"))
+    get_parser.set_defaults(func=create_cmd_factory("ReleaseCommands", "get"))
 
     update_parser = subparsers.add_parser("update")
     update_parser.add_argument(
         "--infile", action=FileInputAction, default=FileArg(sys.stdin.buffer))
     update_parser.set_defaults(
-        func=create_cmd_factory(ReleaseCommands, "update"))
+        func=create_cmd_factory("ReleaseCommands", "update"))
 
     remove_parser = subparsers.add_parser("rm")
     remove_parser.add_argument("id")
     remove_parser.set_defaults(
-        func=create_cmd_factory(ReleaseCommands, "remove"))
+        func=create_cmd_factory("ReleaseCommands", "remove"))
 
 
 def setup_assets_parser(root_subparsers):
     parser = root_subparsers.add_parser("assets")
-    parser.set_defaults(func=lambda **kwargs: parser.print_help())
+    parser.set_defaults(func=print_help_cmd(parser))
     subparsers = parser.add_subparsers(help="sub-commands")
 
     create_parser = subparsers.add_parser("create")
     create_parser.add_argument(
-        "file", action=FileInputAction, default=FileArg(sys.stdin.buffer))
+        "file", nargs="?", action=FileInputAction, default=FileArg(sys.stdin.buffer))
     create_parser.add_argument(
         "--release", help="release identifier", required=True)
     create_parser.add_argument("--name")
+    create_parser.add_argument(
+        "--dir", help="upload a directory as an archive that is built while it is sent")
+    create_parser.add_argument(
+        "--format", choices=archive_formats,
+        help="archive format for --dir, by default taken from --name, or tar.gz")
     create_parser.add_argument(
         "--tag", default=dict(), action=StoreKeyValueAction)
+    create_parser.add_argument(
+        "--verify", help="verify the hash and size of the uploaded content", action="store_true")
+    create_parser.add_argument(
+        "--progress", help="show the progress of the upload on stderr", action="store_true")
     create_parser.set_defaults(
-        func=create_cmd_factory(AssetCommands, "create"))
+        func=create_cmd_factory("AssetCommands", "create"))
 
     list_parser = subparsers.add_parser("ls")
     list_parser.add_argument("--release", help="release identifier",
                              required=True)
-    list_parser.set_defaults(func=create_cmd_factory(AssetCommands, "list"))
+    add_list_output_arguments(list_parser)
+    list_parser.set_defaults(func=create_cmd_factory("AssetCommands", "list"))
+
+    find_parser = subparsers.add_parser("find")
+    find_scope = find_parser.add_mutually_exclusive_group(required=True)
+    find_scope.add_argument("--release", help="release identifier")
+    find_scope.add_argument("--app", help="app identifier, searches all releases")
+    find_parser.add_argument("--tag", default=dict(), action=StoreKeyValueAction,
+                             help="tag to match (key=value), or key alone to match any value")
+    find_parser.add_argument("--refresh", help="re-list assets that are already indexed",
+                             action="store_true")
+    add_list_output_arguments(find_parser)
+    find_parser.set_defaults(func=create_cmd_factory("AssetCommands", "find"))
 
     get_parser = subparsers.add_parser("get")
     get_parser.add_argument("id")
-    get_parser.set_defaults(func=create_cmd_factory(AssetCommands, "get"))
+    get_parser.set_defaults(func=create_cmd_factory("AssetCommands", "get"))
 
     remove_parser = subparsers.add_parser("rm")
     remove_parser.add_argument("id")
     remove_parser.set_defaults(
-        func=create_cmd_factory(AssetCommands, "remove"))
+        func=create_cmd_factory("AssetCommands", "remove"))
 
     download_parser = subparsers.add_parser("download")
     download_parser.add_argument("id")
     download_parser.add_argument(
         "--out", action=FileOutputAction, default=FileArg(sys.stdout.buffer))
+    download_parser.add_argument(
+        "--progress", help="show the progress of the download on stderr", action="store_true")
+    download_parser.add_argument(
+        "--extract", metavar="DIR", help="unpack the archive into a directory while downloading it")
+    download_parser.add_argument(
+        "--format", choices=archive_formats,
+        help="archive format for --extract, by default detected from the asset name")
     download_parser.set_defaults(
-        func=create_cmd_factory(AssetCommands, "download"))
+        func=create_cmd_factory("AssetCommands", "download"))
 
 
 def setup_access_token_parser(root_subparsers):
     parser = root_subparsers.add_parser("tokens")
-    parser.set_defaults(func=lambda **kwargs: parser.print_help())
+    parser.set_defaults(func=print_help_cmd(parser))
     subparsers = parser.add_subparsers(help="sub-commands")
 
     create_parser = subparsers.add_parser("create")
@@ -127,27 +203,28 @@ def setup_access_token_parser(root_subparsers):
     create_parser.add_argument("--enabled", action="store_true")
     create_parser.add_argument("--access", required=True, type=int)
     create_parser.set_defaults(
-        func=create_cmd_factory(AccessTokenCommands, "create"))
+        func=create_cmd_factory("AccessTokenCommands", "create"))
 
     list_parser = subparsers.add_parser("ls")
     list_parser.add_argument("--app", help="app identifier")
+    add_list_output_arguments(list_parser)
     list_parser.set_defaults(
-        func=create_cmd_factory(AccessTokenCommands, "list"))
+        func=create_cmd_factory("AccessTokenCommands", "list"))
 
     get_parser = subparsers.add_parser("get")
     get_parser.add_argument("id")
     get_parser.set_defaults(
-        func=create_cmd_factory(AccessTokenCommands, "get"))
+        func=create_cmd_factory("AccessTokenCommands", "get"))
 
     remove_parser = subparsers.add_parser("rm")
     remove_parser.add_argument("id")
     remove_parser.set_defaults(
-        func=create_cmd_factory(AccessTokenCommands, "remove"))
+        func=create_cmd_factory("AccessTokenCommands", "remove"))
 
 
 def setup_webhook_parser(root_subparsers):
     parser = root_subparsers.add_parser("webhooks")
-    parser.set_defaults(func=lambda **kwargs: parser.print_help())
+    parser.set_defaults(func=print_help_cmd(parser))
     subparsers = parser.add_subparsers(help="sub-commands")
 
     create_parser = subparsers.add_parser("create")
@@ -158,23 +235,83 @@ def setup_webhook_parser(root_subparsers):
     create_parser.add_argument(
         "--events", required=True, action=WebhookEventsAction)
     create_parser.set_defaults(
-        func=create_cmd_factory(WebhookCommands, "create"))
+        func=create_cmd_factory("WebhookCommands", "create"))
 
     list_parser = subparsers.add_parser("ls")
     list_parser.add_argument("--app", help="app identifier", required=True)
-    list_parser.set_defaults(func=create_cmd_factory(WebhookCommands, "list"))
+    add_list_output_arguments(list_parser)
+    list_parser.set_defaults(func=create_cmd_factory("WebhookCommands", "list"))
 
     get_parser = subparsers.add_parser("get")
     get_parser.add_argument("id")
-    get_parser.set_defaults(func=create_cmd_factory(WebhookCommands, "get"))
+    get_parser.set_defaults(func=create_cmd_factory("WebhookCommands", "get"))
 
     remove_parser = subparsers.add_parser("rm")
     remove_parser.add_argument("id")
     remove_parser.set_defaults(
-        func=create_cmd_factory(WebhookCommands, "remove"))
+        func=create_cmd_factory("WebhookCommands", "remove"))
+
+
+def setup_setup_parser(root_subparsers):
+    setup_parser = root_subparsers.add_parser("setup")
+    setup_parser.set_defaults(func=create_lazy_cmd(".setup", "cmd_setup"))
 
 
-def setup_root_parser():
+def setup_test_parser(root_subparsers):
+    test_parser = root_subparsers.add_parser("test")
+    test_parser.set_defaults(func=create_lazy_cmd(".test", "cmd_test"))
+    test_parser.add_argument("--skip-delete", help="skip deleting resources upon completion",
+                             action="store_true")
+    test_parser.add_argument("--workers", type=int,
+                             help="run the scenario concurrently in this many threads")
+    test_parser.add_argument("--iterations", type=int,
+                             help="number of times each worker runs the scenario")
+    test_parser.add_argument("--duration", type=float,
+                             help="seconds after which the workers stop starting new scenarios")
+    test_parser.add_argument("--stub", action="store_true",
+                             help="run against a local in-memory stub server instead of --server")
+
+
+def setup_batch_parser(root_subparsers):
+    batch_parser = root_subparsers.add_parser("batch", help=sub_command_help["batch"])
+    batch_parser.add_argument(
+        "--infile", action=FileInputAction, default=FileArg(sys.stdin.buffer),
+        help="file with one command per line, e.g. [\"apps\", \"get\", \"myapp\"]")
+    batch_parser.add_argument("--workers", type=int, default=1,
+                              help="number of commands to run concurrently")
+    batch_parser.set_defaults(func=create_lazy_cmd(".batch", "cmd_batch"))
+
+
+def setup_watch_parser(root_subparsers):
+    watch_parser = root_subparsers.add_parser("watch", help=sub_command_help["watch"])
+    watch_parser.add_argument("resource", choices=("apps", "releases", "assets", "tokens", "webhooks"))
+    watch_parser.add_argument("--app", help="app identifier")
+    watch_parser.add_argument("--release", help="release identifier")
+    watch_parser.add_argument("--state", help="file that keeps track of known resources between runs")
+    watch_parser.add_argument("--min-interval", type=float, default=5,
+                              help="seconds between polls after a change")
+    watch_parser.add_argument("--max-interval", type=float, default=300,
+                              help="longest number of seconds between polls while idle")
+    watch_parser.add_argument("--emit-existing", action="store_true",
+                              help="report existing resources when there is no previous state")
+    watch_parser.add_argument("--once", action="store_true", help="poll once and exit")
+    watch_parser.set_defaults(func=create_lazy_cmd(".watch", "cmd_watch"))
+
+
+sub_command_parsers = {
+    "setup": setup_setup_parser,
+    "test": setup_test_parser,
+    "apps": setup_apps_parser,
+    "releases": setup_releases_parser,
+    "assets": setup_assets_parser,
+    "tokens": setup_access_token_parser,
+    "webhooks": setup_webhook_parser,
+    "batch": setup_batch_parser,
+    "watch": setup_watch_parser,
+}
+
+
+def setup_root_parser(args: List[str]):
     root_parser = argparse.ArgumentParser(
         description="Python client for Build Center API")
     root_parser.add_argument(
@@ -184,31 +321,75 @@ def setup_root_parser():
         default=os.environ.get("BC_SERVER", local_server_url))
     root_parser.add_argument(
         "--proxy", help="proxy server address (host:port)")
+    root_parser.add_argument(
+        "--http2", help="use HTTP/2 to multiplex requests over one connection (requires httpx), "
+                        "http:// servers must accept HTTP/2 without TLS (h2c)",
+        action="store_true")
     root_parser.add_argument(
         "--token", help="API access token, alternatively set with environment variable BC_TOKEN",
         default=os.environ.get("BC_TOKEN", None))
-    root_parser.set_defaults(func=lambda **kwargs: root_parser.print_help())
+    root_parser.add_argument(
+        "--connect-timeout", help="seconds to wait for a connection to the server (default: 10)",
+        type=float, default=10)
+    root_parser.add_argument(
+        "--read-timeout", help="seconds to wait for the server to send or accept data (default: 60)",
+        type=float, default=60)
+    root_parser.add_argument(
+        "--deadline", help="seconds that the whole command may take, including all of its requests",
+        type=float)
+    root_parser.add_argument(
+        "--limit-rate", help="bytes per second for asset uploads and downloads each, e.g. 500K or 20M",
+        type=parse_rate)
+    root_parser.add_argument(
+        "--limit-upload-rate", help="bytes per second for asset uploads, overrides --limit-rate",
+        type=parse_rate)
+    root_parser.add_argument(
+        "--limit-download-rate", help="bytes per second for asset downloads, overrides --limit-rate",
+        type=parse_rate)
+    root_parser.add_argument(
+        "--profile", help="print the time spent in each phase of the command and each request to stderr",
+        action="store_true")
+    root_parser.add_argument(
+        "--profile-out", help="also write cProfile statistics to a file, to be read with pstats")
+    root_parser.set_defaults(func=print_help_cmd(root_parser))
 
     root_subparsers = root_parser.add_subparsers(help="sub-commands")
 
-    setup_parser = root_subparsers.add_parser("setup")
-    setup_parser.set_defaults(func=cmd_setup)
-
-    test_parser = root_subparsers.add_parser("test")
-    test_parser.set_defaults(func=cmd_test)
-    test_parser.add_argument("--skip-delete", help="skip deleting resources upon completion",
-                             action="store_true")
-
-    setup_apps_parser(root_subparsers)
-    setup_releases_parser(root_subparsers)
-    setup_assets_parser(root_subparsers)
-    setup_access_token_parser(root_subparsers)
-    setup_webhook_parser(root_subparsers)
+    # Only the sub-command that is going to run gets its full parser, the others
+    # are registered by name so that they still show up in the help text
+    selected_command = find_sub_command(root_parser, args)
+    for name, setup_sub_parser in sub_command_parsers.items():
+        if name == selected_command:
+            setup_sub_parser(root_subparsers)
+        else:
+            root_subparsers.add_parser(name, help=sub_command_help.get(name))
 
     return root_parser
 
 
-def parse_args():
-    parser = setup_root_parser()
-    args = parser.parse_args()
-    return args
+def find_sub_command(root_parser: argparse.ArgumentParser, args: List[str]) -> Optional[str]:
+    options = {}
+    for action in root_parser._actions:
+        for option in action.option_strings:
+            options[option] = action.nargs != 0
+    args = iter(args)
+    for arg in args:
+        if arg == "--":
+            return next(args, None)
+        if arg.startswith("-"):
+            if "=" in arg:
+                continue
+            # Long options can be abbreviated to a unique prefix, as argparse allows
+            matches = [option for option in options if option.startswith(arg)] \
+                if arg.startswith("--") and arg not in options else [arg]
+            if len(matches) == 1 and options.get(matches[0]):
+                next(args, None)
+            continue
+        return arg
+    return None
+
+
+def parse_args(args: List[str] = None):
+    args = sys.argv[1:] if args is None else args
+    parser = setup_root_parser(args)
+    return parser.parse_args(args)
@@ -0,0 +1,57 @@
+import sys
+from typing import IO, Optional
+
+from build_center_client.api.progress import Progress
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "TiB"
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
+
+
+class ProgressPrinter:
+    # Prints transfer progress to stderr. Terminals get a single line that is updated in
+    # place, otherwise, e.g. in CI logs, a line is printed every log_interval seconds.
+    def __init__(self, label: str, out: IO = None, log_interval: float = 5) -> None:
+        self._label = label
+        self._out = sys.stderr if out is None else out
+        self._is_terminal = self._out.isatty()
+        self._log_interval = log_interval
+        self._next_log = 0.0
+        self._line_length = 0
+
+    def __call__(self, progress: Progress):
+        if not self._is_terminal and not progress.finished and progress.elapsed < self._next_log:
+            return
+        self._next_log = progress.elapsed + self._log_interval
+        done = format_size(progress.done)
+        if progress.total:
+            done += f" / {format_size(progress.total)} {progress.done * 100 / progress.total:5.1f} %"
+        if progress.finished:
+            line = f"{self._label}: {done} in {format_duration(progress.elapsed)}, " \
+                f"{format_size(progress.average_rate)}/s"
+        else:
+            line = f"{self._label}: {done}  {format_size(progress.rate)}/s " \
+                f"(avg {format_size(progress.average_rate)}/s)  ETA {format_duration(progress.eta)}"
+        if self._is_terminal:
+            # Pad to overwrite the rest of a longer previous line
+            self._out.write("\r" + line.ljust(self._line_length))
+            self._line_length = len(line)
+            if progress.finished:
+                self._out.write("\n")
+        else:
+            self._out.write(line + "\n")
+        self._out.flush()
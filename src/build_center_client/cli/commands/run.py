@@ -1,4 +1,8 @@
+from typing import Dict
 import logging
+import sys
+
+from build_center_client.api.timeouts import deadline
 
 
 logger = logging.getLogger("buildcenter")
@@ -12,6 +16,31 @@ def setup_logger(level: str):
     logger.addHandler(ch)
 
 
-def run_app(args):
+def run_app(args, started_at: float = None, phases: Dict[str, float] = None):
     setup_logger(args.log)
-    args.func(**vars(args))
+    kwargs = dict(vars(args))
+    seconds = kwargs.pop("deadline", None)
+    profile_out = kwargs.pop("profile_out", None)
+    profile = None
+    profiler = None
+    if kwargs.pop("profile", False) or profile_out is not None:
+        # Imported here as profiling is rarely used
+        from build_center_client.api import profiling
+        profile = profiling.start(started_at)
+        for name, phase_seconds in ({} if phases is None else phases).items():
+            profile.add_phase(name, phase_seconds)
+        if profile_out is not None:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+    try:
+        # The deadline covers every request the command makes
+        with deadline(seconds):
+            args.func(**kwargs)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_out)
+        if profile is not None:
+            profile.report(sys.stderr)
+            profiling.stop()
@@ -0,0 +1,346 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+import gzip
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+
+
+# Resource collections by the path segment they are served under
+_collections = {
+    "apps": "apps",
+    "releases": "releases",
+    "assets": "assets",
+    "access-tokens": "tokens",
+    "tokens": "tokens",
+    "webhooks": "webhooks",
+}
+# Field that links a nested resource to its parent, by the parent's collection
+_parent_fields = {
+    "apps": "appId",
+    "releases": "releaseId",
+}
+
+
+def _json(status: int, data: Any) -> Tuple[int, bytes, str]:
+    return status, json.dumps(data).encode("utf-8"), "application/json"
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, which would otherwise wait for delayed ACKs
+    disable_nagle_algorithm = True
+    server: "_StubHttpServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_PUT(self):
+        self._route("PUT")
+
+    def do_PATCH(self):
+        self._route("PATCH")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+    def handle(self):
+        # HTTP/2 clients with prior knowledge (h2c) start with "PRI * HTTP/2.0" instead of a request
+        if self.rfile.peek(3)[:3] == b"PRI" and _import_h2() is not None:
+            _Http2Connection(self).run()
+        else:
+            super().handle()
+
+    def _route(self, method: str):
+        body = self._read_body()
+        # Responses are sent outside of the lock, so slow clients don't hold up others
+        self._send(*self._respond(method, self.path, body, self.headers.get("Content-Type")))
+
+    def _respond(self, method: str, path: str, body: bytes,
+                 content_type: Optional[str]) -> Tuple[int, bytes, Optional[str]]:
+        path = path.split("?")[0].strip("/").split("/")
+        if len(path) < 2 or path[0] != "admin" or path[1] not in _collections:
+            return _json(404, {"error": "Not found"})
+        if self.server.stub.latency:
+            time.sleep(self.server.stub.latency)
+        with self.server.lock:
+            return self._handle(method, path[1:], body, content_type)
+
+    def _handle(self, method: str, path: List[str], body: bytes,
+                content_type: Optional[str]) -> Tuple[int, bytes, Optional[str]]:
+        stub = self.server.stub
+        collection = _collections[path[0]]
+        if len(path) == 1:
+            if method == "GET":
+                return _json(200, list(stub.resources[collection].values()))
+            if method == "POST":
+                return _json(200, stub.create(collection, json.loads(body)))
+        resource = stub.find(collection, path[1]) if len(path) > 1 else None
+        if resource is None:
+            return _json(404, {"error": "Not found"})
+        if len(path) == 2:
+            if method == "GET":
+                return _json(200, resource)
+            if method in ("PUT", "PATCH"):
+                resource.update({key: value for key, value in json.loads(body).items()
+                                 if value is not None and key not in ("id", "url", "createdAt")})
+                return _json(200, resource)
+            if method == "DELETE":
+                stub.delete(collection, resource["id"])
+                return 204, b"", None
+        if len(path) == 3 and path[2] == "download" and collection == "assets" and method == "GET":
+            return 200, stub.contents[resource["id"]], "application/octet-stream"
+        if len(path) == 3 and path[2] in _collections and collection in _parent_fields:
+            child_collection = _collections[path[2]]
+            parent_field = _parent_fields[collection]
+            if method == "GET":
+                return _json(200, [child for child in stub.resources[child_collection].values()
+                                             if child.get(parent_field) == resource["id"]])
+            if method == "POST" and child_collection == "assets":
+                return _json(200, stub.create_asset(resource["id"], *self._parse_upload(body, content_type)))
+            if method == "POST":
+                data = json.loads(body)
+                data[parent_field] = resource["id"]
+                return _json(200, stub.create(child_collection, data))
+        return _json(404, {"error": "Not found"})
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            body = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                body += self.rfile.read(size)
+                self.rfile.readline()
+            body = bytes(body)
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    def _parse_upload(self, body: bytes, content_type: str):
+        boundary = re.search("boundary=([^;]+)", content_type).group(1).strip('"')
+        name, content, tags = None, b"", {}
+        for part in body.split(b"--" + boundary.encode("utf-8"))[1:-1]:
+            head, _, value = part[2:].partition(b"\r\n\r\n")
+            value = value[:-2]
+            field = re.search(rb'name="([^"]+)"', head).group(1).decode("utf-8")
+            if field == "file":
+                name = re.search(rb'filename="([^"]*)"', head).group(1).decode("utf-8")
+                content = value
+            elif field == "tag":
+                key, _, tag_value = value.decode("utf-8").partition("=")
+                tags[key] = tag_value or None
+        return name, content, tags
+
+    def _send(self, status: int, body: bytes, content_type: str = None):
+        self.send_response(status)
+        if content_type is not None:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _import_h2():
+    # h2 is installed with the optional httpx[http2] dependency
+    try:
+        import h2.config
+        import h2.connection
+        import h2.events
+        import h2.exceptions
+        return h2
+    except ImportError:
+        return None
+
+
+class _Http2Connection:
+    # Serves the requests of an HTTP/2 connection. Each stream is answered by a thread of its
+    # own, so that concurrent requests are multiplexed as by a real server.
+    def __init__(self, handler: _StubHandler) -> None:
+        self._handler = handler
+        self._h2 = _import_h2()
+        self._connection = self._h2.connection.H2Connection(
+            self._h2.config.H2Configuration(client_side=False, header_encoding="utf-8"))
+        self._lock = threading.Lock()
+        self._requests: Dict[int, Tuple[Dict[str, str], bytearray]] = {}
+        # Response data that is waiting for the client's flow control window, by stream
+        self._pending: Dict[int, memoryview] = {}
+        self._closed = False
+
+    def run(self):
+        try:
+            self._serve()
+        finally:
+            with self._lock:
+                self._closed = True
+
+    def _serve(self):
+        events = self._h2.events
+        with self._lock:
+            self._connection.initiate_connection()
+            self._flush()
+        while True:
+            data = self._handler.rfile.read1(65536)
+            if not data:
+                return
+            with self._lock:
+                try:
+                    received = self._connection.receive_data(data)
+                except self._h2.exceptions.ProtocolError:
+                    # h2 has closed the connection, the client is told why
+                    self._flush()
+                    return
+                for event in received:
+                    if isinstance(event, events.RequestReceived):
+                        self._requests[event.stream_id] = (dict(event.headers), bytearray())
+                    elif isinstance(event, events.DataReceived) and event.stream_id in self._requests:
+                        self._requests[event.stream_id][1].extend(event.data)
+                        self._connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, events.StreamEnded):
+                        headers, body = self._requests.pop(event.stream_id)
+                        threading.Thread(target=self._respond, args=(event.stream_id, headers, bytes(body)),
+                                         daemon=True).start()
+                    elif isinstance(event, events.StreamReset):
+                        self._requests.pop(event.stream_id, None)
+                        self._pending.pop(event.stream_id, None)
+                    elif isinstance(event, events.ConnectionTerminated):
+                        return
+                self._send_pending()
+                self._flush()
+
+    def _respond(self, stream_id: int, headers: Dict[str, str], body: bytes):
+        if headers.get("content-encoding") == "gzip":
+            body = gzip.decompress(body)
+        status, body, content_type = self._handler._respond(
+            headers[":method"], headers[":path"], body, headers.get("content-type"))
+        response_headers = [(":status", str(status)), ("content-length", str(len(body)))]
+        if content_type is not None:
+            response_headers.append(("content-type", content_type))
+        with self._lock:
+            if self._closed:
+                return
+            try:
+                self._connection.send_headers(stream_id, response_headers, end_stream=not body)
+            except self._h2.exceptions.ProtocolError:
+                # The stream was reset, or the connection closed
+                return
+            if body:
+                self._pending[stream_id] = memoryview(body)
+                self._send_pending()
+            self._flush()
+
+    def _send_pending(self):
+        for stream_id, data in list(self._pending.items()):
+            try:
+                while data:
+                    size = min(len(data), self._connection.local_flow_control_window(stream_id),
+                               self._connection.max_outbound_frame_size)
+                    if size <= 0:
+                        break
+                    self._connection.send_data(stream_id, data[:size].tobytes(), end_stream=size == len(data))
+                    data = data[size:]
+            except self._h2.exceptions.StreamClosedError:
+                data = None
+            if data:
+                self._pending[stream_id] = data
+            else:
+                del self._pending[stream_id]
+
+    def _flush(self):
+        data = self._connection.data_to_send()
+        if data:
+            self._handler.wfile.write(data)
+
+
+class _StubHttpServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 resets connections when many clients connect at once
+    request_queue_size = 128
+
+    def __init__(self, address, stub: "StubServer") -> None:
+        super().__init__(address, _StubHandler)
+        self.stub = stub
+        self.lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # Clients that give up on a request, e.g. on a deadline, close the connection mid-way
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubServer:
+    # In-memory stand-in for the admin API of Build Center, enough to run the test command
+    # without a server, e.g. in CI. Authorization isn't checked. Speaks HTTP/1.1, and HTTP/2
+    # with prior knowledge if h2 is installed. latency is added to every response, in seconds,
+    # to simulate a server that isn't local.
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0) -> None:
+        self._server = _StubHttpServer((host, port), self)
+        self.latency = latency
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self.resources: Dict[str, Dict[str, dict]] = {name: {} for name in set(_collections.values())}
+        self.contents: Dict[str, bytes] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def find(self, collection: str, key: str) -> Optional[dict]:
+        # Apps can also be looked up by name
+        resource = self.resources[collection].get(key)
+        if resource is None and collection == "apps":
+            resource = next((app for app in self.resources["apps"].values() if app.get("name") == key), None)
+        return resource
+
+    def create(self, collection: str, data: dict) -> dict:
+        id = str(uuid.uuid4())
+        path = [path for path, name in _collections.items() if name == collection][0]
+        resource = {key: value for key, value in data.items() if value is not None}
+        resource.update(id=id, createdAt=int(time.time() * 1000))
+        # Webhooks have the URL they call instead of their own
+        resource.setdefault("url", f"{self.url}/admin/{path}/{id}")
+        if collection == "tokens":
+            resource["value"] = f"stub-{uuid.uuid4().hex}"
+        self.resources[collection][id] = resource
+        return resource
+
+    def create_asset(self, release_id: str, name: str, content: bytes, tags: Dict[str, Optional[str]]) -> dict:
+        resource = self.create("assets", dict(
+            name=name, contentSize=len(content), contentHashAlgorithm="sha256",
+            contentHash=hashlib.sha256(content).hexdigest(), tags=tags, releaseId=release_id))
+        # Null tag values are kept, they mean a tag without a value
+        resource["tags"] = tags
+        self.contents[resource["id"]] = content
+        return resource
+
+    def delete(self, collection: str, id: str):
+        del self.resources[collection][id]
+        self.contents.pop(id, None)
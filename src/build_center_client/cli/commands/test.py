@@ -1,17 +1,45 @@
 import os
-from time import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from time import monotonic, perf_counter, time
+import io
 import logging
+import math
 import platform
+import sys
+import threading
+import uuid
+from typing import IO, Callable, Dict, List
 
 from build_center_client.api.api import AccessFlags, WebhookEvent, WebhookType
+from build_center_client.api.timeouts import current_deadline, deadline
 from .factory import create_api
 
 
 initial_access_token_id = "initial"
 logger = logging.getLogger("buildcenter.test")
+sample_file_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "test_files", "sample_file.txt")
 
 
-def cmd_test(skip_delete: str = None, **kwargs):
+def cmd_test(skip_delete: str = None, workers: int = None, iterations: int = None,
+             duration: float = None, stub: bool = False, **kwargs):
+    stub_server = None
+    if stub:
+        from .stub_server import StubServer
+        stub_server = StubServer().start()
+        kwargs["server"] = stub_server.url
+        logger.info(f"Started stub server at {stub_server.url}")
+    try:
+        if workers is None and iterations is None and duration is None:
+            run_scenario(skip_delete, **kwargs)
+        else:
+            run_load_test(skip_delete, workers, iterations, duration, **kwargs)
+    finally:
+        if stub_server is not None:
+            stub_server.close()
+
+
+def run_scenario(skip_delete: str = None, **kwargs):
     initial_api = create_api(**kwargs)
 
     admin_rw_token = initial_api.access_tokens.create(
@@ -32,7 +60,7 @@ def cmd_test(skip_delete: str = None, **kwargs):
     release = app.releases().create(version="1.0.0")
     logger.info(f"Created release {release.id} for app {app.id}")
 
-    with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "test_files", "sample_file.txt"), "rb") as f:
+    with open(sample_file_path, "rb") as f:
         asset = release.assets().create_with_file(
             "file.txt",
             f,
@@ -81,3 +109,148 @@ def cmd_test(skip_delete: str = None, **kwargs):
             if access_token.id != initial_access_token_id:
                 logger.info(f"Deleting global access token {access_token.id}")
                 initial_api.access_tokens.delete(access_token.id)
+
+
+@dataclass
+class OperationStats:
+    # Seconds taken by each successful call
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    # Nearest-rank percentile
+    index = max(math.ceil(percent / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+class LoadTestResults:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.operations: Dict[str, OperationStats] = {}
+        self.iterations = 0
+        self.failed_iterations = 0
+
+    def add_operation(self, name: str, seconds: float, ok: bool):
+        with self._lock:
+            stats = self.operations.setdefault(name, OperationStats())
+            if ok:
+                stats.latencies.append(seconds)
+            else:
+                stats.errors += 1
+
+    def add_iteration(self, ok: bool):
+        with self._lock:
+            self.iterations += 1
+            self.failed_iterations += 0 if ok else 1
+
+    def report(self, out: IO, workers: int, seconds: float):
+        with self._lock:
+            operations = {name: OperationStats(sorted(stats.latencies), stats.errors)
+                          for name, stats in self.operations.items()}
+        calls = sum(len(stats.latencies) + stats.errors for stats in operations.values())
+        out.write(f"Load test: {workers} workers, {self.iterations} iterations "
+                  f"({self.failed_iterations} failed) in {seconds:.2f} s, "
+                  f"{self.iterations / seconds:.1f} iterations/s, {calls / seconds:.1f} operations/s\n")
+        out.write(f"  {'operation':<16}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p90 ms':>10}"
+                  f"{'p99 ms':>10}{'max ms':>10}\n")
+        for name, stats in operations.items():
+            line = f"  {name:<16}{len(stats.latencies):>7}{stats.errors:>8}"
+            if stats.latencies:
+                for percent in (50, 90, 99, 100):
+                    line += f"{percentile(stats.latencies, percent) * 1000:>10.1f}"
+            out.write(line + "\n")
+        out.flush()
+
+
+def run_iteration(api, results: LoadTestResults, name: str, content: bytes, skip_delete: str = None) -> bool:
+    # The scenario of run_scenario() on resources of its own, timing every operation.
+    # Whatever was created is deleted again, also after a failure.
+    def timed(operation: str, func: Callable, *args, **kwargs):
+        started_at = perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            results.add_operation(operation, perf_counter() - started_at, False)
+            logger.warning(f"{operation} failed for {name}: {e}")
+            raise
+        results.add_operation(operation, perf_counter() - started_at, True)
+        return result
+
+    created = []
+    ok = True
+    try:
+        app = timed("create app", api.apps.create, name=name, title=f"Load test {name}")
+        created.append(("delete app", api.apps.delete, app.id))
+        release = timed("create release", app.releases().create, version="1.0.0")
+        created.append(("delete release", api.releases.delete, release.id))
+        asset = timed("upload asset", release.assets().create_with_file, "file.txt", io.BytesIO(content),
+                      tags={"arch": platform.machine(), "os": platform.system()})
+        created.append(("delete asset", api.assets.delete, asset.id))
+        timed("get asset", api.assets.get, asset.id)
+        timed("list assets", release.assets().list)
+        timed("download asset", asset.download, io.BytesIO())
+        webhook = timed("create webhook", app.webhooks().create, type=WebhookType.DISCORD,
+                        url="http://localhost:5000/webhook-test",
+                        events=(WebhookEvent.RELEASE_PUBLISHED, WebhookEvent.PRERELEASE_PUBLISHED))
+        created.append(("delete webhook", api.webhooks.delete, webhook.id))
+    except Exception:
+        ok = False
+    if not skip_delete:
+        for operation, delete, id in reversed(created):
+            try:
+                timed(operation, delete, id)
+            except Exception:
+                ok = False
+    results.add_iteration(ok)
+    return ok
+
+
+def run_load_test(skip_delete: str = None, workers: int = None, iterations: int = None,
+                  duration: float = None, **kwargs):
+    # Runs the scenario concurrently. Each worker runs iterations scenarios, or as many as
+    # fit into duration seconds, or both, whichever ends first. Without either, one each.
+    workers = max(1 if workers is None else workers, 1)
+    if iterations is None and duration is None:
+        iterations = 1
+    initial_api = create_api(**kwargs)
+    admin_rw_token = initial_api.access_tokens.create(
+        enabled=True, access=AccessFlags.ADMIN | AccessFlags.READ | AccessFlags.WRITE,
+        description="Load test admin read/write token")
+    logger.info(f"Created global access token {admin_rw_token.id}")
+    admin_rw_api_create_args = dict(**kwargs)
+    admin_rw_api_create_args["token"] = admin_rw_token.value
+    # The workers share one client, like the threads of an application would
+    admin_rw_api = create_api(**admin_rw_api_create_args, pool_size=workers)
+
+    with open(sample_file_path, "rb") as f:
+        content = f.read()
+    run_id = uuid.uuid4().hex[:8]
+    results = LoadTestResults()
+    # Deadlines are per thread, so the deadline of the command is passed on to the workers
+    expires_at = current_deadline()
+    started_at = monotonic()
+    stop_at = None if duration is None else started_at + duration
+    # No new scenarios are started once they would fail on the deadline right away
+    if expires_at is not None:
+        stop_at = expires_at if stop_at is None else min(stop_at, expires_at)
+
+    def work(worker: int):
+        with deadline(expires_at=expires_at):
+            iteration = 0
+            while (iterations is None or iteration < iterations) and \
+                    (stop_at is None or monotonic() < stop_at):
+                run_iteration(admin_rw_api, results, f"load-{run_id}-{worker}-{iteration}", content,
+                              skip_delete)
+                iteration += 1
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(work, range(workers)))
+    finally:
+        results.report(sys.stdout, workers, monotonic() - started_at)
+        if not skip_delete:
+            logger.info(f"Deleting global access token {admin_rw_token.id}")
+            initial_api.access_tokens.delete(admin_rw_token.id)
+    if results.failed_iterations:
+        sys.exit(1)
@@ -0,0 +1,42 @@
+import sys
+
+from build_center_client.api import json_backend
+from build_center_client.api.encoding import ApiJsonEncoder
+from build_center_client.api.watch import WatchEvent, Watcher
+from .factory import create_api
+
+
+def get_watch_endpoint(api, resource: str, app: str = None, release: str = None):
+    if resource == "apps":
+        return api.apps
+    if resource == "assets":
+        if release is None:
+            raise Exception("--release is required to watch assets")
+        return api.releases.get(release).assets()
+    if resource == "tokens" and app is None:
+        return api.access_tokens
+    if app is None:
+        raise Exception(f"--app is required to watch {resource}")
+    app_ = api.apps.get(app)
+    return {"releases": app_.releases, "webhooks": app_.webhooks, "tokens": app_.tokens}[resource]()
+
+
+def print_watch_event(event: WatchEvent):
+    line = {"event": event.type.value, "id": event.id}
+    if event.resource is not None:
+        line["resource"] = ApiJsonEncoder.encode(event.resource, level=1)
+    sys.stdout.write(json_backend.dumps_compact(line).decode("utf-8") + "\n")
+    sys.stdout.flush()
+
+
+def cmd_watch(resource: str, app: str = None, release: str = None, state: str = None,
+              min_interval: float = 5, max_interval: float = 300, emit_existing: bool = False,
+              once: bool = False, **kwargs):
+    api = create_api(**kwargs)
+    watcher = Watcher(get_watch_endpoint(api, resource, app=app, release=release),
+                      state_path=state, min_interval=min_interval, max_interval=max_interval,
+                      emit_existing=emit_existing)
+    try:
+        watcher.run(print_watch_event, once=once)
+    except KeyboardInterrupt:
+        pass
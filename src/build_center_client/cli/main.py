@@ -1,8 +1,14 @@
+import time
+started_at = time.perf_counter()
+
 from .commands.parser import parse_args
 from .commands.run import run_app
 
 def main_cli():
-    run_app(parse_args())
+    imported_at = time.perf_counter()
+    args = parse_args()
+    run_app(args, started_at=started_at,
+            phases={"startup": imported_at - started_at, "parse": time.perf_counter() - imported_at})
 
 if __name__ == "__main__":
     main_cli()